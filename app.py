@@ -1,110 +1,83 @@
+import os
+import re
 import sqlite3
+import sys
+import tempfile
+import time
 from datetime import date
 
 import pandas as pd
 import streamlit as st
 
-DB_PATH = "sales.db"
-
-
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            sku TEXT UNIQUE,
-            price REAL NOT NULL,
-            stock INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS customers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            phone TEXT,
-            email TEXT,
-            address TEXT,
-            created_at TEXT NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER NOT NULL,
-            order_date TEXT NOT NULL,
-            status TEXT NOT NULL,
-            total REAL NOT NULL DEFAULT 0,
-            FOREIGN KEY (customer_id) REFERENCES customers(id)
-        );
-        CREATE TABLE IF NOT EXISTS order_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            qty INTEGER NOT NULL,
-            price REAL NOT NULL,
-            FOREIGN KEY (order_id) REFERENCES orders(id),
-            FOREIGN KEY (product_id) REFERENCES products(id)
-        );
-        """
-    )
-    conn.commit()
-    conn.close()
-
-
-def fetch_df(query, params=None):
-    conn = get_conn()
-    df = pd.read_sql_query(query, conn, params=params or [])
-    conn.close()
-    return df
-
-
-def execute(query, params=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(query, params or [])
-    conn.commit()
-    last_id = cur.lastrowid
-    conn.close()
-    return last_id
-
-
-def execute_many(query, rows):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.executemany(query, rows)
-    conn.commit()
-    conn.close()
-
-
-def get_or_create_walkin_customer_id():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM customers WHERE name = ? LIMIT 1", ("Khách lẻ",))
-    row = cur.fetchone()
-    if row:
-        conn.close()
-        return int(row["id"])
-    cur.execute(
-        "INSERT INTO customers (name, phone, email, address, created_at) VALUES (?, ?, ?, ?, ?)",
-        ("Khách lẻ", None, None, None, date.today().isoformat()),
-    )
-    conn.commit()
-    customer_id = cur.lastrowid
-    conn.close()
-    return int(customer_id)
+from db import (
+    CUSTOMER_SEGMENTS,
+    DB_PATH,
+    EXPORT_DATASETS,
+    EXPORT_FORMATS,
+    OutOfStockError,
+    PAGE_SIZE,
+    REORDER_LEAD_DAYS,
+    REORDER_REVIEW_DAYS,
+    REORDER_WINDOW_DAYS,
+    SQL_CUSTOMER_SEGMENTS,
+    SQL_INSERT_CUSTOMER,
+    SQL_INVOICE_ITEMS,
+    SQL_REVENUE_BY_DAY,
+    SQL_STOCK_HISTORY,
+    SQL_TOP_PRODUCTS,
+    STOCK_MOVEMENT_KINDS,
+    WALKIN_NAME,
+    add_product,
+    adjust_stock,
+    backup_database,
+    backup_folder,
+    bootstrap_db,
+    cli,
+    create_order,
+    customer_row,
+    ensure_stock_snapshot,
+    excel_sheet_names,
+    execute,
+    export_dataset,
+    export_file_name,
+    fetch_customer_summary,
+    fetch_df,
+    fetch_inventory,
+    fetch_invoices,
+    fetch_low_stock,
+    get_backup_scheduler,
+    get_profiler,
+    get_query_cache,
+    get_reorder_engine,
+    get_walkin_customer_id,
+    get_writer,
+    has_products,
+    import_customers,
+    import_products,
+    iter_excel_chunks,
+    list_backups,
+    list_invoice_ids,
+    list_order_statuses,
+    lookup_customers,
+    lookup_products,
+    refresh_customer_stats,
+    search_customer_stats,
+    search_customers,
+    search_orders,
+    search_products,
+    text_or,
+    write_invoices,
+)
+from invoices import invoice_file_name, render_invoice_html
 
+PAGE_SIZE_OPTIONS = (25, 50, 100, 200)
+IMPORT_PREVIEW_ROWS = 20
+PERF_PANEL = os.environ.get("QLBH_PERF_PANEL", "") == "1"
+# Service level -> z-score of the normal distribution for safety stock.
+SERVICE_LEVELS = {"90%": 1.28, "95%": 1.65, "99%": 2.33}
 
-st.set_page_config(page_title="Quản lý bán hàng", layout="wide")
-init_db()
 
-st.markdown(
-    """
+APP_CSS = """
 <style>
 body { background: #f6f7fb; }
 .block-container { padding-top: 1.5rem; }
@@ -143,18 +116,164 @@ body { background: #f6f7fb; }
 .badge-teal { background: #18a2a5; }
 .badge-gold { background: #c49a00; }
 </style>
-""",
-    unsafe_allow_html=True,
-)
+"""
 
-st.title("🧾 Quản lý bán hàng")
 
-tabs = st.tabs(
-    ["Sản phẩm", "Tồn kho", "Khách hàng", "Đơn hàng", "Hóa đơn", "Báo cáo", "Nhập Excel"]
-)
+def paged_listing(key, search, filters, cursor_columns=("id",)):
+    cursor_key = f"{key}_cursors"
+    filter_key = f"{key}_filters"
+    page_size = st.selectbox(
+        "Số dòng mỗi trang",
+        PAGE_SIZE_OPTIONS,
+        index=PAGE_SIZE_OPTIONS.index(PAGE_SIZE),
+        key=f"{key}_page_size",
+    )
+    signature = (page_size, tuple(sorted(filters.items())))
+    if st.session_state.get(filter_key) != signature:
+        st.session_state[filter_key] = signature
+        st.session_state[cursor_key] = [None]
+    cursors = st.session_state[cursor_key]
+
+    df, has_more = search(after_id=cursors[-1], page_size=page_size, **filters)
+    st.dataframe(df, use_container_width=True)
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button(
+            "← Trang trước",
+            key=f"{key}_prev",
+            disabled=len(cursors) == 1,
+            on_click=cursors.pop,
+        )
+    with col_page:
+        st.caption(f"Trang {len(cursors)}")
+    with col_next:
+        st.button(
+            "Trang sau →",
+            key=f"{key}_next",
+            disabled=not has_more,
+            on_click=cursors.append,
+            args=(last_cursor(df, cursor_columns) if has_more else None,),
+        )
+    return df
+
+
+def last_cursor(df, columns):
+    # Arrow-backed columns hand back plain Python values, ready to bind as parameters.
+    values = tuple(df[column].iloc[-1] for column in columns)
+    return int(values[0]) if len(values) == 1 else values
+
+
+def date_range_filter(label, key):
+    value = st.date_input(label, value=(), key=key)
+    date_from = value[0].isoformat() if len(value) > 0 else None
+    date_to = value[1].isoformat() if len(value) > 1 else date_from
+    return date_from, date_to
+
+
+def order_filters_ui(key):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        customer = st.text_input("Lọc theo khách hàng", key=f"{key}_customer_filter")
+    with col2:
+        status = st.selectbox(
+            "Trạng thái", ["Tất cả"] + list_order_statuses(), key=f"{key}_status_filter"
+        )
+    with col3:
+        date_from, date_to = date_range_filter("Khoảng ngày", f"{key}_date_filter")
+    return {
+        "customer": customer.strip(),
+        "status": None if status == "Tất cả" else status,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+
+
+def export_controls(key, name, date_from=None, date_to=None):
+    def build():
+        with tempfile.TemporaryFile() as out:
+            export_dataset(name, fmt, out, date_from, date_to)
+            out.seek(0)
+            return out.read()
+
+    col1, col2 = st.columns([1, 3], vertical_alignment="bottom")
+    with col1:
+        fmt = st.selectbox(
+            "Định dạng", list(EXPORT_FORMATS), format_func=str.upper, key=f"{key}_export_format"
+        )
+    with col2:
+        st.download_button(
+            f"Xuất {EXPORT_DATASETS[name][0].lower()}",
+            build,
+            file_name=export_file_name(name, fmt, date_from, date_to),
+            mime=EXPORT_FORMATS[fmt][2],
+            on_click="ignore",
+            key=f"{key}_export",
+        )
 
 
-with tabs[0]:
+def excel_import_section(title, key, upload_label, fields, importer, noun):
+    st.markdown('<div class="section-card">', unsafe_allow_html=True)
+    st.markdown(f"### {title}")
+    uploaded = st.file_uploader(upload_label, type=["xlsx"], key=key)
+    if uploaded is not None:
+        try:
+            sheets = excel_sheet_names(uploaded)
+            sheet = st.selectbox("Trang tính", sheets, key=f"{key}_sheet")
+            preview = next(iter_excel_chunks(uploaded, sheet, IMPORT_PREVIEW_ROWS), None)
+        except Exception as exc:
+            st.error(f"Không đọc được file Excel: {exc}")
+        else:
+            if preview is None:
+                st.warning("Trang tính không có dữ liệu.")
+            else:
+                st.caption(f"Xem trước {len(preview)} dòng đầu")
+                st.dataframe(preview, use_container_width=True)
+                skip = "— Không có —"
+                columns = {}
+                for position, (col, (field, label, required)) in enumerate(
+                    zip(st.columns(len(fields)), fields)
+                ):
+                    with col:
+                        options = list(preview.columns) if required else [skip, *preview.columns]
+                        # Default to the column in the same position as the template.
+                        default = position if required else position + 1
+                        choice = st.selectbox(
+                            label,
+                            options,
+                            index=default if default < len(options) else 0,
+                            key=f"{key}_{field}",
+                        )
+                        columns[field] = None if choice == skip else choice
+                if st.button(f"Nhập {noun}", key=f"{key}_run"):
+                    bar = st.progress(0.0, text="Đang nhập...")
+                    result = importer(
+                        uploaded,
+                        columns,
+                        sheet=sheet,
+                        progress=lambda done, total: bar.progress(
+                            min(done / total, 1.0) if total else 0.5,
+                            text=f"Đã xử lý {done:,}/{total or '?'} dòng",
+                        ),
+                    )
+                    rejects = result["rejects"]
+                    if result["imported"]:
+                        st.success(f"Đã nhập {result['imported']} {noun}.")
+                    else:
+                        st.warning("Không có dữ liệu hợp lệ để nhập.")
+                    if not rejects.empty:
+                        st.warning(f"{len(rejects)} dòng bị loại.")
+                        st.download_button(
+                            "Tải file dòng lỗi",
+                            rejects.to_csv(index=False).encode("utf-8-sig"),
+                            file_name=f"{key}_loi.csv",
+                            mime="text/csv",
+                            key=f"{key}_rejects",
+                        )
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
+def render_products():
     st.markdown(
         '<div class="section-card tone-blue"><div class="section-title">'
         '<span class="badge badge-blue">Sản phẩm</span></div></div>',
@@ -177,59 +296,128 @@ with tabs[0]:
             if not name.strip():
                 st.warning("Vui lòng nhập tên sản phẩm.")
             else:
-                execute(
-                    "INSERT INTO products (name, sku, price, stock, created_at) VALUES (?, ?, ?, ?, ?)",
-                    (name.strip(), sku.strip() or None, price, int(stock), date.today().isoformat()),
-                )
+                add_product(name.strip(), sku.strip() or None, price, int(stock))
                 st.success("Đã thêm sản phẩm.")
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.subheader("Danh sách sản phẩm")
-    products_df = fetch_df(
-        "SELECT id, name, sku, price, stock, created_at FROM products ORDER BY id DESC"
+    col1, col2 = st.columns(2)
+    with col1:
+        name_filter = st.text_input("Lọc theo tên", key="products_name_filter")
+    with col2:
+        sku_filter = st.text_input("Lọc theo SKU", key="products_sku_filter")
+    products_df = paged_listing(
+        "products", search_products, {"name": name_filter.strip(), "sku": sku_filter.strip()}
     )
-    st.dataframe(products_df, use_container_width=True)
 
     if not products_df.empty:
         st.markdown('<div class="section-card">', unsafe_allow_html=True)
         st.subheader("Xóa sản phẩm")
-        product_map = (
-            products_df["id"].astype(str)
-            + " - "
-            + products_df["name"].astype(str)
-        ).tolist()
-        selected = st.selectbox("Chọn sản phẩm", product_map)
+        product_labels = dict(zip(products_df["id"], products_df["name"]))
+        product_id = st.selectbox(
+            "Chọn sản phẩm",
+            list(product_labels),
+            format_func=lambda x: f"{x} - {product_labels[x]}",
+        )
         if st.button("Xóa"):
-            product_id = int(selected.split(" - ")[0])
-            execute("DELETE FROM products WHERE id = ?", (product_id,))
-            st.success("Đã xóa sản phẩm.")
+            try:
+                execute("DELETE FROM products WHERE id = ?", (int(product_id),))
+            except sqlite3.IntegrityError:
+                st.error("Sản phẩm đã có trong đơn hàng nên không thể xóa.")
+            else:
+                st.success("Đã xóa sản phẩm.")
         st.markdown("</div>", unsafe_allow_html=True)
 
 
-with tabs[1]:
+def render_inventory():
     st.markdown(
         '<div class="section-card tone-green"><div class="section-title">'
         '<span class="badge badge-green">Tồn kho</span></div></div>',
         unsafe_allow_html=True,
     )
-    st.subheader("Tồn kho hiện tại")
-    inventory_df = fetch_df(
-        "SELECT name AS 'Sản phẩm', sku AS 'SKU', price AS 'Giá bán', stock AS 'Tồn kho' FROM products"
-    )
+    ensure_stock_snapshot()
+    st.subheader("Tồn kho theo ngày")
+    day = st.date_input("Tại cuối ngày", value=date.today(), key="inventory_day").isoformat()
+    inventory_df = fetch_inventory(day)
     st.dataframe(inventory_df, use_container_width=True)
+    export_controls("inventory", "inventory", date_to=day)
 
     st.markdown('<div class="section-card">', unsafe_allow_html=True)
     st.subheader("Cảnh báo tồn kho thấp")
-    threshold = st.number_input("Ngưỡng cảnh báo", min_value=1, value=10, step=1)
-    low_stock_df = fetch_df(
-        "SELECT name AS 'Sản phẩm', sku AS 'SKU', stock AS 'Tồn kho' FROM products WHERE stock <= ?",
-        (int(threshold),),
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        lead_days = st.number_input(
+            "Thời gian chờ hàng (ngày)", min_value=1, value=REORDER_LEAD_DAYS, step=1
+        )
+    with col2:
+        review_days = st.number_input(
+            "Chu kỳ đặt hàng (ngày)", min_value=1, value=REORDER_REVIEW_DAYS, step=1
+        )
+    with col3:
+        service_level = st.selectbox("Mức phục vụ", list(SERVICE_LEVELS), index=1)
+    reorder_df = get_reorder_engine(DB_PATH).recommend(
+        int(lead_days), int(review_days), SERVICE_LEVELS[service_level]
+    )
+    st.caption(
+        f"Theo tốc độ bán {REORDER_WINDOW_DAYS} ngày gần nhất, xếp theo nguy cơ hết hàng"
     )
-    st.dataframe(low_stock_df, use_container_width=True)
+    if reorder_df.empty:
+        st.info("Chưa có sản phẩm cần nhập thêm.")
+    else:
+        st.dataframe(reorder_df, use_container_width=True)
+    with st.expander("Lọc theo ngưỡng cố định"):
+        threshold = st.number_input("Ngưỡng cảnh báo", min_value=1, value=10, step=1)
+        low_stock_df = fetch_low_stock(int(threshold), day)
+        st.dataframe(low_stock_df, use_container_width=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
+    st.subheader("Điều chỉnh tồn kho")
+    search_term = st.text_input("Tìm sản phẩm (tên, SKU hoặc mã vạch)", key="stock_product_search")
+    matches_df = lookup_products(search_term)
+    if matches_df.empty:
+        st.caption("Không tìm thấy sản phẩm phù hợp.")
+        return
+    matches = {int(row.id): row for row in matches_df.itertuples(index=False)}
+    product_id = st.selectbox(
+        "Sản phẩm",
+        list(matches),
+        format_func=lambda x: (
+            f"{matches[x].name} ({text_or(matches[x].sku, 'không SKU')}) - tồn {matches[x].stock}"
+        ),
+        key="stock_product",
+    )
+    with st.form("adjust_stock"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            kind = st.selectbox(
+                "Loại",
+                ["adjustment", "return", "import"],
+                format_func=STOCK_MOVEMENT_KINDS.__getitem__,
+            )
+        with col2:
+            qty = st.number_input("Số lượng (+ nhập, - xuất)", value=0, step=1)
+        with col3:
+            movement_day = st.date_input("Ngày", value=date.today())
+        note = st.text_input("Ghi chú (kiểm kê, hao hụt...)")
+        if st.form_submit_button("Ghi sổ kho"):
+            if not qty:
+                st.warning("Số lượng phải khác 0.")
+            else:
+                try:
+                    adjust_stock(
+                        product_id, int(qty), kind, note.strip() or None, movement_day.isoformat()
+                    )
+                except OutOfStockError as exc:
+                    st.error(str(exc))
+                else:
+                    st.success("Đã ghi nhận thay đổi tồn kho.")
+
+    history_df = fetch_df(SQL_STOCK_HISTORY, (product_id, 50))
+    history_df["Loại"] = history_df["Loại"].map(STOCK_MOVEMENT_KINDS)
+    st.dataframe(history_df, use_container_width=True)
 
-with tabs[2]:
+
+def render_customers():
     st.markdown(
         '<div class="section-card tone-orange"><div class="section-title">'
         '<span class="badge badge-orange">Khách hàng</span></div></div>',
@@ -252,54 +440,53 @@ with tabs[2]:
                 st.warning("Vui lòng nhập tên khách hàng.")
             else:
                 execute(
-                    "INSERT INTO customers (name, phone, email, address, created_at) VALUES (?, ?, ?, ?, ?)",
-                    (
+                    SQL_INSERT_CUSTOMER,
+                    customer_row(
                         cname.strip(),
                         phone.strip() or None,
                         email.strip() or None,
                         address.strip() or None,
-                        date.today().isoformat(),
                     ),
                 )
                 st.success("Đã thêm khách hàng.")
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.subheader("Danh sách khách hàng")
-    customers_df = fetch_df(
-        """
-        SELECT id, name, phone, email, address, created_at
-        FROM customers
-        WHERE name != 'Khách lẻ'
-        ORDER BY id DESC
-        """
+    col1, col2 = st.columns(2)
+    with col1:
+        name_filter = st.text_input("Lọc theo tên", key="customers_name_filter")
+    with col2:
+        phone_filter = st.text_input("Lọc theo SĐT", key="customers_phone_filter")
+    customers_df = paged_listing(
+        "customers",
+        search_customers,
+        {"name": name_filter.strip(), "phone": phone_filter.strip()},
     )
-    st.dataframe(customers_df, use_container_width=True)
 
     if not customers_df.empty:
         st.markdown('<div class="section-card">', unsafe_allow_html=True)
         st.subheader("Xóa khách hàng")
-        customer_map = (
-            customers_df["id"].astype(str) + " - " + customers_df["name"].astype(str)
-        ).tolist()
-        selected = st.selectbox("Chọn khách hàng", customer_map)
+        customer_labels = dict(zip(customers_df["id"], customers_df["name"]))
+        customer_id = st.selectbox(
+            "Chọn khách hàng",
+            list(customer_labels),
+            format_func=lambda x: f"{x} - {customer_labels[x]}",
+        )
         if st.button("Xóa khách hàng"):
-            customer_id = int(selected.split(" - ")[0])
-            execute("DELETE FROM customers WHERE id = ?", (customer_id,))
+            execute("DELETE FROM customers WHERE id = ?", (int(customer_id),))
             st.success("Đã xóa khách hàng.")
         st.markdown("</div>", unsafe_allow_html=True)
 
 
-with tabs[3]:
+def render_orders():
     st.markdown(
         '<div class="section-card tone-purple"><div class="section-title">'
         '<span class="badge badge-purple">Đơn hàng</span></div></div>',
         unsafe_allow_html=True,
     )
     st.subheader("Tạo đơn hàng")
-    customers_df = fetch_df("SELECT id, name FROM customers ORDER BY name")
-    products_df = fetch_df("SELECT id, name, price, stock FROM products ORDER BY name")
 
-    if products_df.empty:
+    if not has_products():
         st.info("Cần có sản phẩm trước khi tạo đơn hàng.")
     else:
         if "order_items" not in st.session_state:
@@ -307,41 +494,61 @@ with tabs[3]:
 
         col1, col2 = st.columns(2)
         with col1:
-            customer_options = ["Khách lẻ"]
-            customer_map = {}
-            if not customers_df.empty:
-                for _, row in customers_df.iterrows():
-                    label = f'{row["name"]} (ID {row["id"]})'
-                    customer_options.append(label)
-                    customer_map[label] = int(row["id"])
-            selected_customer = st.selectbox("Khách hàng", customer_options)
+            customer_term = st.text_input(
+                "Tìm khách hàng (tên hoặc SĐT)", key="order_customer_search"
+            )
+            customers_df = lookup_customers(customer_term)
+            customer_labels = {None: WALKIN_NAME}
+            customer_labels.update(
+                (int(customer_id), f"{name} - {text_or(phone, 'không SĐT')} (ID {customer_id})")
+                for customer_id, name, phone in zip(
+                    customers_df["id"], customers_df["name"], customers_df["phone"]
+                )
+            )
+            selected_customer = st.selectbox(
+                "Khách hàng",
+                list(customer_labels),
+                index=1 if customer_term.strip() and len(customer_labels) > 1 else 0,
+                format_func=customer_labels.__getitem__,
+            )
         with col2:
             order_date = st.date_input("Ngày bán", value=date.today())
 
         st.markdown("#### Thêm sản phẩm vào đơn")
-        colp1, colp2, colp3 = st.columns([2, 1, 1])
-        with colp1:
-            product_id = st.selectbox(
-                "Sản phẩm",
-                products_df["id"],
-                format_func=lambda x: products_df.set_index("id").loc[x, "name"],
-            )
-        with colp2:
-            qty = st.number_input("Số lượng", min_value=1, value=1, step=1)
-        with colp3:
-            if st.button("Thêm vào đơn"):
-                product_row = products_df.set_index("id").loc[product_id]
-                if qty > product_row["stock"]:
-                    st.warning("Tồn kho không đủ.")
-                else:
-                    st.session_state.order_items.append(
-                        {
-                            "product_id": int(product_id),
-                            "name": product_row["name"],
-                            "price": float(product_row["price"]),
-                            "qty": int(qty),
-                        }
-                    )
+        search_term = st.text_input(
+            "Tìm sản phẩm (tên, SKU hoặc mã vạch)", key="order_product_search"
+        )
+        matches_df = lookup_products(search_term)
+        if matches_df.empty:
+            st.caption("Không tìm thấy sản phẩm phù hợp.")
+        else:
+            matches = {int(row.id): row for row in matches_df.itertuples(index=False)}
+            colp1, colp2, colp3 = st.columns([2, 1, 1])
+            with colp1:
+                product_id = st.selectbox(
+                    "Sản phẩm",
+                    list(matches),
+                    format_func=lambda x: (
+                        f"{matches[x].name} ({text_or(matches[x].sku, 'không SKU')}) - "
+                        f"tồn {matches[x].stock}"
+                    ),
+                )
+            with colp2:
+                qty = st.number_input("Số lượng", min_value=1, value=1, step=1)
+            with colp3:
+                if st.button("Thêm vào đơn"):
+                    product_row = matches[product_id]
+                    if qty > product_row.stock:
+                        st.warning("Tồn kho không đủ.")
+                    else:
+                        st.session_state.order_items.append(
+                            {
+                                "product_id": int(product_id),
+                                "name": product_row.name,
+                                "price": float(product_row.price),
+                                "qty": int(qty),
+                            }
+                        )
 
         if st.session_state.order_items:
             items_df = pd.DataFrame(st.session_state.order_items)
@@ -359,90 +566,102 @@ with tabs[3]:
                     st.session_state.order_items = []
             with colc2:
                 if st.button("Tạo đơn hàng"):
-                    if selected_customer == "Khách lẻ":
-                        customer_id = get_or_create_walkin_customer_id()
+                    if selected_customer is None:
+                        customer_id = get_walkin_customer_id(DB_PATH)
                     else:
-                        customer_id = customer_map[selected_customer]
-                    order_id = execute(
-                        "INSERT INTO orders (customer_id, order_date, status, total) VALUES (?, ?, ?, ?)",
-                        (int(customer_id), order_date.isoformat(), "Đã tạo", total),
-                    )
-                    rows = [
-                        (order_id, item["product_id"], item["qty"], item["price"])
-                        for item in st.session_state.order_items
-                    ]
-                    execute_many(
-                        "INSERT INTO order_items (order_id, product_id, qty, price) VALUES (?, ?, ?, ?)",
-                        rows,
-                    )
-                    for item in st.session_state.order_items:
-                        execute(
-                            "UPDATE products SET stock = stock - ? WHERE id = ?",
-                            (item["qty"], item["product_id"]),
+                        customer_id = selected_customer
+                    try:
+                        create_order(
+                            customer_id, order_date.isoformat(), st.session_state.order_items
                         )
-                    st.session_state.order_items = []
-                    st.success("Đã tạo đơn hàng và cập nhật tồn kho.")
+                    except OutOfStockError as exc:
+                        st.error(str(exc))
+                    else:
+                        st.session_state.order_items = []
+                        st.success("Đã tạo đơn hàng và cập nhật tồn kho.")
 
     st.subheader("Danh sách đơn hàng")
-    orders_df = fetch_df(
-        """
-        SELECT o.id, o.order_date, o.status, o.total,
-               c.name AS customer
-        FROM orders o
-        JOIN customers c ON o.customer_id = c.id
-        ORDER BY o.id DESC
-        """
-    )
-    st.dataframe(orders_df, use_container_width=True)
+    filters = order_filters_ui("orders")
+    paged_listing("orders", search_orders, filters)
+    st.caption("Xuất đơn hàng kèm chi tiết trong khoảng ngày đã lọc")
+    export_controls("orders", "orders", filters["date_from"], filters["date_to"])
 
 
-with tabs[4]:
+def render_invoices():
     st.markdown(
         '<div class="section-card tone-red"><div class="section-title">'
         '<span class="badge badge-red">Hóa đơn</span></div></div>',
         unsafe_allow_html=True,
     )
     st.subheader("Hóa đơn")
-    orders_df = fetch_df(
-        """
-        SELECT o.id, o.order_date, o.total, o.status, c.name AS customer
-        FROM orders o
-        JOIN customers c ON o.customer_id = c.id
-        ORDER BY o.id DESC
-        """
-    )
+    filters = order_filters_ui("invoices")
+    filters["archived"] = st.checkbox("Tìm cả đơn đã lưu trữ", key="invoices_archived")
+    orders_df = paged_listing("invoices", search_orders, filters)
     if orders_df.empty:
         st.info("Chưa có hóa đơn.")
     else:
-        order_map = (
-            orders_df["id"].astype(str)
-            + " - "
-            + orders_df["customer"].astype(str)
-            + " ("
-            + orders_df["order_date"].astype(str)
-            + ")"
-        ).tolist()
-        selected = st.selectbox("Chọn hóa đơn", order_map)
-        order_id = int(selected.split(" - ")[0])
-        invoice_df = fetch_df(
-            """
-            SELECT p.name AS 'Sản phẩm', i.qty AS 'Số lượng',
-                   i.price AS 'Đơn giá', (i.qty * i.price) AS 'Thành tiền'
-            FROM order_items i
-            JOIN products p ON i.product_id = p.id
-            WHERE i.order_id = ?
-            """,
-            (order_id,),
+        order_labels = {
+            order_id: f"{order_id} - {customer} ({order_date})"
+            for order_id, customer, order_date in zip(
+                orders_df["id"], orders_df["customer"], orders_df["order_date"]
+            )
+        }
+        order_id = int(
+            st.selectbox(
+                "Chọn hóa đơn", list(order_labels), format_func=order_labels.__getitem__
+            )
         )
+        invoice_df = fetch_df(SQL_INVOICE_ITEMS, (order_id,))
         st.dataframe(invoice_df, use_container_width=True)
         total = float(invoice_df["Thành tiền"].sum()) if not invoice_df.empty else 0
-        st.markdown(
-            f"**Tổng tiền:** {total:,.0f} | **Trạng thái:** "
-            f"{orders_df.set_index('id').loc[order_id, 'status']}"
+        status = orders_df.loc[orders_df["id"] == order_id, "status"].iloc[0]
+        st.markdown(f"**Tổng tiền:** {total:,.0f} | **Trạng thái:** {status}")
+        # Built only when the button is clicked, not on every rerun of the page.
+        st.download_button(
+            "Tải hóa đơn để in",
+            lambda: render_invoice_html(fetch_invoices([order_id])[0]),
+            file_name=invoice_file_name(order_id),
+            mime="text/html",
+            on_click="ignore",
         )
 
+    st.subheader("Xuất hóa đơn hàng loạt")
+    col1, col2 = st.columns(2)
+    with col1:
+        date_from, date_to = date_range_filter("Khoảng ngày", "invoice_batch_dates")
+    with col2:
+        ids_text = st.text_input("Hoặc mã đơn (cách nhau bởi dấu phẩy)", key="invoice_batch_ids")
+    if st.button("Tạo file zip hóa đơn"):
+        if ids_text.strip():
+            order_ids = [int(value) for value in re.findall(r"\d+", ids_text)]
+        elif date_from:
+            order_ids = list_invoice_ids(date_from, date_to)
+        else:
+            order_ids = []
+            st.warning("Chọn khoảng ngày hoặc nhập mã đơn.")
+        if order_ids:
+            progress_bar = st.progress(0.0)
+
+            def report(done, total):
+                progress_bar.progress(done / total, text=f"Đã tạo {done}/{total} hóa đơn")
+
+            with tempfile.TemporaryFile() as archive:
+                count = write_invoices(order_ids, archive, as_zip=True, progress=report)
+                archive.seek(0)
+                data = archive.read()
+            st.success(f"Đã tạo {count} hóa đơn.")
+            st.download_button(
+                "Tải file zip",
+                data,
+                file_name="_".join(["hoa_don"] + [v for v in (date_from, date_to) if v]) + ".zip",
+                mime="application/zip",
+                on_click="ignore",
+            )
+        elif ids_text.strip() or date_from:
+            st.info("Không có hóa đơn phù hợp.")
+
 
-with tabs[5]:
+def render_reports():
     st.markdown(
         '<div class="section-card tone-teal"><div class="section-title">'
         '<span class="badge badge-teal">Báo cáo</span></div></div>',
@@ -455,34 +674,53 @@ with tabs[5]:
     with col2:
         end_date = st.date_input("Đến ngày", value=date.today())
 
-    sales_df = fetch_df(
-        """
-        SELECT order_date AS 'Ngày', SUM(total) AS 'Doanh thu'
-        FROM orders
-        WHERE order_date BETWEEN ? AND ?
-        GROUP BY order_date
-        ORDER BY order_date
-        """,
-        (start_date.isoformat(), end_date.isoformat()),
-    )
+    period = (start_date.isoformat(), end_date.isoformat())
+    sales_df = fetch_df(SQL_REVENUE_BY_DAY, period)
     st.dataframe(sales_df, use_container_width=True)
+    export_controls("revenue", "revenue", *period)
 
     st.subheader("Top sản phẩm bán chạy")
-    top_df = fetch_df(
-        """
-        SELECT p.name AS 'Sản phẩm', SUM(i.qty) AS 'Số lượng bán',
-               SUM(i.qty * i.price) AS 'Doanh thu'
-        FROM order_items i
-        JOIN products p ON i.product_id = p.id
-        GROUP BY p.id
-        ORDER BY SUM(i.qty) DESC
-        LIMIT 10
-        """
-    )
+    st.caption("Trong khoảng ngày đã chọn")
+    top_df = fetch_df(SQL_TOP_PRODUCTS, period)
     st.dataframe(top_df, use_container_width=True)
+    export_controls("product_sales", "product-sales", *period)
+
+    customer_analytics()
+
+
+def customer_analytics():
+    st.subheader("Phân tích khách hàng")
+    if st.button("Cập nhật phân tích"):
+        result = refresh_customer_stats()
+        st.success(
+            f"Đã tính thêm {result['orders']:,} đơn của {result['customers']:,} khách hàng, "
+            f"chấm lại điểm {result['rescored']:,} khách trong {result['seconds']:.2f}s."
+        )
+    summary = fetch_customer_summary()
+    if summary is None:
+        st.info('Chưa có số liệu. Bấm "Cập nhật phân tích" để tính lần đầu.')
+        return
+    st.caption(
+        f"RFM theo toàn bộ lịch sử mua, không gồm {WALKIN_NAME}. "
+        f"Cập nhật lúc {summary['refreshed_at']}, {summary['pending']:,} đơn mới chưa tính."
+    )
+    if not summary["customers"]:
+        return
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Khách đã mua", f"{summary['customers']:,}")
+    col2.metric("Tỷ lệ mua lại", f"{summary['repeat_customers'] / summary['customers']:.1%}")
+    col3.metric("Giá trị vòng đời TB", f"{summary['revenue'] / summary['customers']:,.0f}")
+    st.dataframe(fetch_df(SQL_CUSTOMER_SEGMENTS), use_container_width=True)
+    segment = st.selectbox("Nhóm khách hàng", ["Tất cả", *CUSTOMER_SEGMENTS])
+    paged_listing(
+        "customer_stats",
+        search_customer_stats,
+        {"segment": None if segment == "Tất cả" else segment},
+        cursor_columns=("rfm_score", "revenue", "id"),
+    )
 
 
-with tabs[6]:
+def render_import():
     st.markdown(
         '<div class="section-card tone-gold"><div class="section-title">'
         '<span class="badge badge-gold">Nhập Excel</span></div></div>',
@@ -491,90 +729,186 @@ with tabs[6]:
     st.subheader("Nhập dữ liệu từ Excel")
     st.caption("Hỗ trợ nhập Sản phẩm và Khách hàng từ file .xlsx")
 
-    st.markdown('<div class="section-card">', unsafe_allow_html=True)
-    st.markdown("### Nhập Sản phẩm")
-    product_file = st.file_uploader("Chọn file Excel sản phẩm", type=["xlsx"], key="import_products")
-    if product_file is not None:
-        try:
-            prod_df = pd.read_excel(product_file, dtype=str).fillna("")
-        except Exception as exc:
-            st.error(f"Không đọc được file Excel: {exc}")
-        else:
-            st.dataframe(prod_df, use_container_width=True)
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                name_col = st.selectbox("Cột Tên sản phẩm", prod_df.columns, key="p_name")
-            with col2:
-                sku_col = st.selectbox("Cột SKU", prod_df.columns, key="p_sku")
-            with col3:
-                price_col = st.selectbox("Cột Giá", prod_df.columns, key="p_price")
-            with col4:
-                stock_col = st.selectbox("Cột Tồn kho", prod_df.columns, key="p_stock")
-            if st.button("Nhập sản phẩm"):
-                rows = []
-                for _, r in prod_df.iterrows():
-                    name_val = str(r[name_col]).strip()
-                    if not name_val:
-                        continue
-                    rows.append(
-                        (
-                            name_val,
-                            str(r[sku_col]).strip() or None,
-                            float(str(r[price_col]).strip() or 0),
-                            int(float(str(r[stock_col]).strip() or 0)),
-                            date.today().isoformat(),
-                        )
-                    )
-                if rows:
-                    execute_many(
-                        "INSERT INTO products (name, sku, price, stock, created_at) VALUES (?, ?, ?, ?, ?)",
-                        rows,
-                    )
-                    st.success(f"Đã nhập {len(rows)} sản phẩm.")
-                else:
-                    st.warning("Không có dữ liệu hợp lệ để nhập.")
-    st.markdown("</div>", unsafe_allow_html=True)
+    excel_import_section(
+        "Nhập Sản phẩm",
+        "import_products",
+        "Chọn file Excel sản phẩm",
+        [
+            ("name", "Cột Tên sản phẩm", True),
+            ("sku", "Cột SKU", False),
+            ("price", "Cột Giá", False),
+            ("stock", "Cột Tồn kho", False),
+        ],
+        import_products,
+        "sản phẩm",
+    )
+    excel_import_section(
+        "Nhập Khách hàng",
+        "import_customers",
+        "Chọn file Excel khách hàng",
+        [
+            ("name", "Cột Họ tên", True),
+            ("phone", "Cột SĐT", False),
+            ("email", "Cột Email", False),
+            ("address", "Cột Địa chỉ", False),
+        ],
+        import_customers,
+        "khách hàng",
+    )
 
-    st.markdown('<div class="section-card">', unsafe_allow_html=True)
-    st.markdown("### Nhập Khách hàng")
-    customer_file = st.file_uploader("Chọn file Excel khách hàng", type=["xlsx"], key="import_customers")
-    if customer_file is not None:
-        try:
-            cust_df = pd.read_excel(customer_file, dtype=str).fillna("")
-        except Exception as exc:
-            st.error(f"Không đọc được file Excel: {exc}")
-        else:
-            st.dataframe(cust_df, use_container_width=True)
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                cname_col = st.selectbox("Cột Họ tên", cust_df.columns, key="c_name")
-            with col2:
-                phone_col = st.selectbox("Cột SĐT", cust_df.columns, key="c_phone")
-            with col3:
-                email_col = st.selectbox("Cột Email", cust_df.columns, key="c_email")
-            with col4:
-                addr_col = st.selectbox("Cột Địa chỉ", cust_df.columns, key="c_addr")
-            if st.button("Nhập khách hàng"):
-                rows = []
-                for _, r in cust_df.iterrows():
-                    name_val = str(r[cname_col]).strip()
-                    if not name_val:
-                        continue
-                    rows.append(
-                        (
-                            name_val,
-                            str(r[phone_col]).strip() or None,
-                            str(r[email_col]).strip() or None,
-                            str(r[addr_col]).strip() or None,
-                            date.today().isoformat(),
-                        )
-                    )
-                if rows:
-                    execute_many(
-                        "INSERT INTO customers (name, phone, email, address, created_at) VALUES (?, ?, ?, ?, ?)",
-                        rows,
-                    )
-                    st.success(f"Đã nhập {len(rows)} khách hàng.")
-                else:
-                    st.warning("Không có dữ liệu hợp lệ để nhập.")
-    st.markdown("</div>", unsafe_allow_html=True)
+
+def render_performance():
+    st.markdown(
+        '<div class="section-card tone-red"><div class="section-title">'
+        '<span class="badge badge-red">Hiệu năng</span></div></div>',
+        unsafe_allow_html=True,
+    )
+    profiler = get_profiler()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        profiler.slow_ms = st.number_input(
+            "Ngưỡng truy vấn chậm (ms)", min_value=1.0, value=float(profiler.slow_ms), step=10.0
+        )
+    with col2:
+        st.download_button(
+            "Xuất JSON lines",
+            profiler.export_jsonl(),
+            file_name="query_profile.jsonl",
+            mime="application/x-ndjson",
+        )
+    with col3:
+        if st.button("Xóa số liệu"):
+            profiler.reset()
+
+    cache_stats = get_query_cache(DB_PATH).stats()
+    st.caption(
+        f"Cache: {cache_stats['entries']} mục, {cache_stats['bytes'] / 1024:,.0f} KB, "
+        f"{cache_stats['hits']} hit / {cache_stats['misses']} miss"
+    )
+    boot = bootstrap(DB_PATH)
+    steps = ", ".join(f"{name} {ms:,.1f}" for name, ms in boot["steps"].items())
+    st.caption(f"Khởi động lúc {boot['ts']}: {boot['total_ms']:,.1f} ms ({steps})")
+    writer = get_writer(DB_PATH)
+    if writer.batches:
+        st.caption(
+            f"Ghi: {writer.jobs} lệnh trong {writer.batches} lần commit "
+            f"({writer.jobs / writer.batches:.1f} lệnh/commit)"
+        )
+
+    st.subheader("Sao lưu")
+    scheduler = get_backup_scheduler(DB_PATH)
+    if scheduler is None:
+        st.caption("Sao lưu định kỳ đang tắt (đặt QLBH_BACKUP_HOURS để bật).")
+    elif scheduler.error:
+        st.error(f"Lần sao lưu định kỳ gần nhất lỗi: {scheduler.error}")
+    backups = list_backups()
+    if backups:
+        st.caption(f"{len(backups)} bản trong {backup_folder()}, mới nhất: {backups[-1]}")
+    if st.button("Sao lưu ngay"):
+        result = backup_database(compress=True)
+        st.success(
+            f"Đã sao lưu {result['pages']:,} trang vào {result['path']} trong "
+            f"{result['seconds']:.1f}s ({result['pages_per_sec']:,.0f} trang/s)."
+        )
+
+    st.subheader("Các lần chạy gần đây")
+    runs_df = pd.DataFrame(list(profiler.runs))
+    if runs_df.empty:
+        st.info("Chưa có số liệu.")
+    else:
+        st.dataframe(runs_df.iloc[::-1], use_container_width=True)
+        st.dataframe(
+            runs_df.groupby("section")
+            .agg(
+                runs=("wall_ms", "size"),
+                wall_ms=("wall_ms", "mean"),
+                db_ms=("db_ms", "mean"),
+                statements=("statements", "mean"),
+                boot_ms=("boot_ms", "mean"),
+            )
+            .sort_values("db_ms", ascending=False),
+            use_container_width=True,
+        )
+
+    st.subheader("Theo câu lệnh")
+    records_df = pd.DataFrame(list(profiler.records))
+    if not records_df.empty:
+        st.dataframe(
+            records_df.groupby(["section", "kind", "sql"], dropna=False)
+            .agg(
+                calls=("ms", "size"),
+                total_ms=("ms", "sum"),
+                max_ms=("ms", "max"),
+                rows=("rows", "mean"),
+                bytes=("bytes", "mean"),
+                cache_hits=("cached", "sum"),
+            )
+            .sort_values("total_ms", ascending=False)
+            .reset_index(),
+            use_container_width=True,
+        )
+
+    st.subheader("Truy vấn chậm")
+    if not profiler.slow:
+        st.caption(f"Không có câu lệnh nào vượt {profiler.slow_ms:,.0f} ms.")
+    for record in reversed(profiler.slow):
+        with st.expander(f"{record['ms']:,.1f} ms · {record['section']} · {record['sql'][:80]}"):
+            st.code(record["sql"], language="sql")
+            st.write(f"Tham số: {record['params']}")
+            st.code("\n".join(record["plan"]))
+
+    st.subheader("Khung dữ liệu dạng object")
+    if not profiler.fallbacks:
+        st.caption("Mọi kết quả đều đọc được bằng kiểu Arrow.")
+    else:
+        st.dataframe(pd.DataFrame(list(profiler.fallbacks)).iloc[::-1], use_container_width=True)
+
+
+SECTIONS = [
+    ("Sản phẩm", "san-pham", render_products),
+    ("Tồn kho", "ton-kho", render_inventory),
+    ("Khách hàng", "khach-hang", render_customers),
+    ("Đơn hàng", "don-hang", render_orders),
+    ("Hóa đơn", "hoa-don", render_invoices),
+    ("Báo cáo", "bao-cao", render_reports),
+    ("Nhập Excel", "nhap-excel", render_import),
+]
+if PERF_PANEL:
+    SECTIONS.append(("Hiệu năng", "hieu-nang", render_performance))
+
+
+@st.cache_resource
+def bootstrap(path):
+    # Database work is shared with headless callers; the page only adds its CSS.
+    boot = dict(bootstrap_db(path))
+    start = time.perf_counter()
+    boot["css"] = re.sub(r"\s+", " ", APP_CSS).strip()
+    boot["steps"] = dict(boot["steps"], assets=round((time.perf_counter() - start) * 1000, 3))
+    boot["total_ms"] = round(boot["total_ms"] + boot["steps"]["assets"], 3)
+    return boot
+
+
+def main():
+    st.set_page_config(page_title="Quản lý bán hàng", layout="wide")
+    start = time.perf_counter()
+    boot = bootstrap(DB_PATH)
+    boot_ms = (time.perf_counter() - start) * 1000
+    st.markdown(boot["css"], unsafe_allow_html=True)
+    st.title("🧾 Quản lý bán hàng")
+
+    # Only the selected section runs, so a rerun queries just the screen in view.
+    pages = [
+        st.Page(render, title=title, url_path=url_path, default=index == 0)
+        for index, (title, url_path, render) in enumerate(SECTIONS)
+    ]
+    page = st.navigation(pages, position="top")
+    with get_profiler().rerun(page.title) as run:
+        run["boot_ms"] = round(boot_ms, 3)
+        page.run()
+
+
+if __name__ == "__main__":
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(cli(sys.argv[1:]))
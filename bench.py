@@ -0,0 +1,438 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from openpyxl import Workbook
+
+import db
+
+SCALES = {
+    "1k": {"products": 200, "customers": 300, "orders": 400, "import_rows": 1_000},
+    "100k": {"products": 5_000, "customers": 20_000, "orders": 40_000, "import_rows": 10_000},
+    "10m": {"products": 50_000, "customers": 500_000, "orders": 4_000_000, "import_rows": 100_000},
+}
+ITEMS_PER_ORDER = (1, 4)
+DAYS = 730
+POPULARITY_SKEW = 1.1
+INSERT_CHUNK = 20_000
+
+FAMILY_NAMES = [
+    "Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng",
+    "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý",
+]
+MIDDLE_NAMES = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Thanh", "Ngọc", "Quang", "Thu", "Gia"]
+GIVEN_NAMES = [
+    "An", "Bình", "Chi", "Dũng", "Hà", "Hải", "Hạnh", "Hoa", "Hùng", "Hương", "Khánh",
+    "Lan", "Linh", "Long", "Mai", "Nam", "Ngân", "Phong", "Phương", "Quân", "Sơn", "Tâm",
+    "Thảo", "Trang", "Tuấn", "Vy", "Yến",
+]
+PRODUCT_KINDS = [
+    "Bánh quy", "Sữa tươi", "Nước mắm", "Mì gói", "Cà phê", "Trà xanh", "Gạo ST25",
+    "Dầu ăn", "Nước suối", "Kẹo dừa", "Bột giặt", "Dầu gội", "Nước ngọt", "Bánh tráng",
+    "Hạt điều", "Xúc xích",
+]
+PRODUCT_VARIANTS = ["loại 1", "loại 2", "đặc biệt", "ít đường", "hương dâu", "vị cay", "gia đình"]
+PRODUCT_SIZES = ["100g", "250g", "500g", "1kg", "330ml", "500ml", "1L", "hộp 10", "lốc 6"]
+STREETS = ["Lê Lợi", "Trần Hưng Đạo", "Nguyễn Huệ", "Hai Bà Trưng", "Lý Thường Kiệt", "Điện Biên Phủ"]
+CITIES = ["Hà Nội", "TP.HCM", "Đà Nẵng", "Cần Thơ", "Hải Phòng", "Huế"]
+
+
+def vietnamese_name(rng):
+    return f"{rng.choice(FAMILY_NAMES)} {rng.choice(MIDDLE_NAMES)} {rng.choice(GIVEN_NAMES)}"
+
+
+def product_name(rng):
+    return f"{rng.choice(PRODUCT_KINDS)} {rng.choice(PRODUCT_VARIANTS)} {rng.choice(PRODUCT_SIZES)}"
+
+
+def random_day(rng, today):
+    # Recent days and weekends sell more, like a real shop.
+    offset = min(int(rng.expovariate(3.0 / DAYS)), DAYS - 1)
+    day = today - timedelta(days=offset)
+    if day.weekday() < 5 and rng.random() < 0.25:
+        day += timedelta(days=5 - day.weekday())
+    return min(day, today).isoformat()
+
+
+def chunked_insert(conn, query, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            conn.executemany(query, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(query, batch)
+
+
+def generate(scale, seed=42):
+    rng = random.Random(seed)
+    today = date.today()
+    products = scale["products"]
+    opened = (today - timedelta(days=DAYS)).isoformat()
+    db.init_db()
+    with db.get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        chunked_insert(
+            conn,
+            "INSERT INTO products (name, sku, price, stock, created_at) VALUES (?, ?, ?, 0, ?)",
+            (
+                (product_name(rng), f"SP{i:07d}", float(rng.randrange(5, 500) * 1000), opened)
+                for i in range(1, products + 1)
+            ),
+        )
+        # Opening balances go through the stock ledger, which maintains products.stock.
+        chunked_insert(
+            conn,
+            db.SQL_INSERT_MOVEMENT,
+            (
+                db.movement_row(i, opened, rng.randrange(1, 1_000_000), "opening")
+                for i in range(1, products + 1)
+            ),
+        )
+        customer_rows = []
+        for i in range(scale["customers"]):
+            name = vietnamese_name(rng)
+            phone = f"09{rng.randrange(10**8):08d}"
+            address = f"{rng.randrange(1, 500)} {rng.choice(STREETS)}, {rng.choice(CITIES)}"
+            customer_rows.append(db.customer_row(name, phone, None, address, today.isoformat()))
+        chunked_insert(conn, db.SQL_INSERT_CUSTOMER, customer_rows)
+        conn.commit()
+
+    walkin_id = db.get_or_create_walkin_customer_id()
+    # Zipf-like popularity: a few products make most of the sales.
+    weights = [1 / rank**POPULARITY_SKEW for rank in range(1, products + 1)]
+    product_ids = list(range(1, products + 1))
+    rng.shuffle(product_ids)
+    cum_weights = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+
+    with db.get_conn() as conn:
+        prices = dict(conn.execute("SELECT id, price FROM products"))
+        max_customer = conn.execute("SELECT MAX(id) FROM customers").fetchone()[0]
+        next_order_id = (conn.execute("SELECT MAX(id) FROM orders").fetchone()[0] or 0) + 1
+        remaining = scale["orders"]
+        while remaining:
+            batch = min(remaining, INSERT_CHUNK)
+            orders, items, movements = [], [], []
+            for order_id in range(next_order_id, next_order_id + batch):
+                lines = rng.choices(
+                    product_ids, cum_weights=cum_weights, k=rng.randint(*ITEMS_PER_ORDER)
+                )
+                order_date = random_day(rng, today)
+                total_amount = 0.0
+                sold = {}
+                for product_id in lines:
+                    qty = rng.randint(1, 5)
+                    items.append((order_id, product_id, qty, prices[product_id]))
+                    total_amount += qty * prices[product_id]
+                    sold[product_id] = sold.get(product_id, 0) + qty
+                customer_id = walkin_id if rng.random() < 0.4 else rng.randint(1, max_customer)
+                orders.append((order_id, customer_id, order_date, "Đã tạo", total_amount))
+                movements.extend(
+                    db.movement_row(product_id, order_date, -qty, "sale", order_id)
+                    for product_id, qty in sold.items()
+                )
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO orders (id, customer_id, order_date, status, total) VALUES (?, ?, ?, ?, ?)",
+                orders,
+            )
+            conn.executemany(
+                "INSERT INTO order_items (order_id, product_id, qty, price) VALUES (?, ?, ?, ?)",
+                items,
+            )
+            conn.executemany(db.SQL_INSERT_MOVEMENT, movements)
+            conn.commit()
+            next_order_id += batch
+            remaining -= batch
+        conn.execute("BEGIN IMMEDIATE")
+        db.backfill_stock_snapshots(conn)
+        conn.commit()
+        conn.execute("ANALYZE")
+    db.invalidate_tables(None)
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, result
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "runs": len(ordered),
+    }
+
+
+def screen_queries(rng):
+    today = date.today()
+    month = ((today - timedelta(days=30)).isoformat(), today.isoformat())
+    with db.get_conn() as conn:
+        max_order = conn.execute("SELECT MAX(id) FROM orders").fetchone()[0] or 1
+    order_id = rng.randint(1, max_order)
+    product_term = rng.choice(PRODUCT_KINDS)
+    customer_term = rng.choice(FAMILY_NAMES)
+    return {
+        "product_list": lambda: db.search_products()[0],
+        "inventory": lambda: db.fetch_df(db.SQL_INVENTORY),
+        "low_stock": lambda: db.fetch_df(db.SQL_LOW_STOCK, (10,)),
+        "inventory_as_of": lambda: db.fetch_df(db.SQL_INVENTORY_AS_OF, (month[0],)),
+        "order_list": lambda: db.search_orders()[0],
+        "invoice_detail": lambda: db.fetch_df(db.SQL_INVOICE_ITEMS, (order_id,)),
+        "revenue_report": lambda: db.fetch_df(db.SQL_REVENUE_BY_DAY, month),
+        "top_products": lambda: db.fetch_df(db.SQL_TOP_PRODUCTS, month),
+        "product_lookup": lambda: db.lookup_products(product_term),
+        "customer_lookup": lambda: db.lookup_customers(customer_term),
+        "reorder": lambda: db.get_reorder_engine(db.DB_PATH).recommend(),
+        "customer_stats": lambda: db.search_customer_stats()[0],
+    }
+
+
+def bench_queries(repeat, seed):
+    cache = db.get_query_cache(db.DB_PATH)
+    results = {}
+    for name, query in screen_queries(random.Random(seed)).items():
+
+        def cold(query=query):
+            cache.invalidate()
+            db.get_reorder_engine.clear()
+            return query()
+
+        cold_samples, df = timed(cold, repeat)
+        warm_samples, _ = timed(query, repeat)
+        results[name] = {
+            "rows": len(df),
+            "bytes": int(df.memory_usage(deep=True).sum()),
+            "cold": summarize(cold_samples),
+            "warm": summarize(warm_samples),
+        }
+    return results
+
+
+def bench_startup(repeat):
+    def cold():
+        # A fresh process: new pool, schema check, walk-in lookup. The writer thread is kept.
+        db.get_pool(db.DB_PATH).close()
+        for resource in (db.bootstrap_db, db.get_pool, db.get_walkin_customer_id):
+            resource.clear()
+        return db.bootstrap_db(db.DB_PATH)
+
+    cold_samples, boot = timed(cold, repeat)
+    warm_samples, _ = timed(lambda: db.bootstrap_db(db.DB_PATH), repeat)
+    return {
+        "cold": summarize(cold_samples),
+        "warm": summarize(warm_samples),
+        "steps": boot["steps"],
+    }
+
+
+def bench_customer_stats(orders, seed):
+    # Full build on the generated history, then an incremental refresh after new sales.
+    build = db.refresh_customer_stats()
+    rng = random.Random(seed)
+    with db.get_conn() as conn:
+        products = conn.execute("SELECT id, price FROM products LIMIT 200").fetchall()
+        customers = [
+            row[0]
+            for row in conn.execute(
+                "SELECT id FROM customers WHERE name != ? LIMIT 1000", (db.WALKIN_NAME,)
+            )
+        ]
+    for _ in range(orders):
+        row = rng.choice(products)
+        try:
+            db.create_order(
+                rng.choice(customers),
+                date.today().isoformat(),
+                [{"product_id": row["id"], "price": row["price"], "qty": 1}],
+            )
+        except db.OutOfStockError:
+            pass
+    return {"build": build, "incremental": db.refresh_customer_stats()}
+
+
+def bench_checkout(orders, seed):
+    rng = random.Random(seed)
+    with db.get_conn() as conn:
+        products = conn.execute(
+            "SELECT id, price FROM products ORDER BY RANDOM() LIMIT 500"
+        ).fetchall()
+    customer_id = db.get_or_create_walkin_customer_id()
+    samples = []
+    for _ in range(orders):
+        items = [
+            {"product_id": row["id"], "price": row["price"], "qty": 1}
+            for row in rng.sample(products, min(len(products), rng.randint(*ITEMS_PER_ORDER)))
+        ]
+        start = time.perf_counter()
+        try:
+            db.create_order(customer_id, date.today().isoformat(), items)
+        except db.OutOfStockError:
+            pass
+        samples.append((time.perf_counter() - start) * 1000)
+    result = summarize(samples)
+    result["orders_per_sec"] = round(len(samples) / (sum(samples) / 1000), 1)
+    return result
+
+
+def excel_file(rows, seed):
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sản phẩm")
+    sheet.append(["Tên sản phẩm", "SKU", "Giá", "Tồn kho"])
+    for i in range(rows):
+        # Half the SKUs already exist so the upsert path is exercised too.
+        sku = f"SP{rng.randrange(1, rows * 2):07d}" if i % 2 else f"NK{i:07d}"
+        sheet.append([product_name(rng), sku, rng.randrange(5, 500) * 1000, rng.randrange(0, 500)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def bench_import(rows, seed):
+    buffer = excel_file(rows, seed)
+    start = time.perf_counter()
+    result = db.import_products(
+        buffer, {"name": "Tên sản phẩm", "sku": "SKU", "price": "Giá", "stock": "Tồn kho"}
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "imported": result["imported"],
+        "rejected": len(result["rejects"]),
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scale(name, scale, args):
+    workdir = tempfile.mkdtemp(prefix=f"qlbh-bench-{name}-")
+    db.DB_PATH = os.path.join(workdir, "sales.db")
+    try:
+        start = time.perf_counter()
+        generate(scale, args.seed)
+        generate_seconds = time.perf_counter() - start
+        with db.get_conn() as conn:
+            counts = {
+                table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("products", "customers", "orders", "order_items")
+            }
+            # Under WAL the freshly generated pages still sit in the -wal file.
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"[{name}] generated {counts} in {generate_seconds:.1f}s", file=sys.stderr)
+        result = {
+            "config": scale,
+            "counts": counts,
+            "generate_seconds": round(generate_seconds, 2),
+            "db_bytes": sum(
+                os.path.getsize(path)
+                for path in (db.DB_PATH, db.DB_PATH + "-wal")
+                if os.path.exists(path)
+            ),
+            "startup": bench_startup(args.repeat),
+            "customer_stats": bench_customer_stats(args.checkouts, args.seed),
+            "queries": bench_queries(args.repeat, args.seed),
+            "checkout": bench_checkout(args.checkouts, args.seed),
+            "excel_import": bench_import(scale["import_rows"], args.seed),
+        }
+    finally:
+        db.get_pool(db.DB_PATH).close()
+        if args.keep:
+            print(f"[{name}] kept database at {db.DB_PATH}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    regressions = []
+    for scale, result in current["scales"].items():
+        old = baseline.get("scales", {}).get(scale)
+        if not old:
+            continue
+        for query, stats in result["queries"].items():
+            before = old["queries"].get(query, {}).get("cold", {}).get("median_ms")
+            after = stats["cold"]["median_ms"]
+            if before and after > before * threshold:
+                regressions.append(f"{scale}/{query}: {before:.2f}ms -> {after:.2f}ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark các truy vấn của app trên CSDL tạm")
+    parser.add_argument("--scale", action="append", choices=SCALES, help="Mặc định: 1k")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--checkouts", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file (mặc định: stdout)")
+    parser.add_argument("--baseline", help="File JSON lần chạy trước để so sánh")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--keep", action="store_true", help="Giữ lại file CSDL tạm")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "scales": {name: run_scale(name, SCALES[name], args) for name in args.scale or ["1k"]},
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(report, args.baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION  {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
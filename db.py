@@ -0,0 +1,3287 @@
+import argparse
+import codecs
+import functools
+import gzip
+import json
+import math
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from openpyxl import Workbook, load_workbook
+
+from invoices import render_invoice_batch
+
+DB_PATH = "sales.db"
+POOL_SIZE = 4
+POOL_TIMEOUT = 10.0
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 16 * 1024
+QUERY_CACHE_MAX_ENTRIES = 256
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PAGE_SIZE = 50
+PRODUCT_LOOKUP_LIMIT = 20
+CUSTOMER_LOOKUP_LIMIT = 20
+IMPORT_CHUNK_SIZE = 5000
+EXPORT_CHUNK_SIZE = 5000
+CATEGORY_MIN_ROWS = 1000
+XLSX_MAX_ROWS = 1_048_576
+INVOICE_BATCH_SIZE = 200
+INVOICE_WORKERS = os.cpu_count() or 1
+ARCHIVE_BATCH_SIZE = 1000
+BACKUP_DIR = os.environ.get("QLBH_BACKUP_DIR", "backups")
+BACKUP_KEEP = 14
+BACKUP_PAGES = 256
+BACKUP_INTERVAL_HOURS = float(os.environ.get("QLBH_BACKUP_HOURS", "0"))
+INGEST_BATCH_SIZE = 500
+INGEST_MAX_BYTES = 16 * 1024 * 1024
+SQLITE_MAX_INTEGER = 2**63 - 1
+SLOW_QUERY_MS = float(os.environ.get("QLBH_SLOW_QUERY_MS", "100"))
+PROFILE_MAX_RECORDS = 5000
+PROFILE_LOG_PATH = os.environ.get("QLBH_PROFILE_LOG")
+WRITE_BATCH_MAX = 64
+STOCK_SNAPSHOT_DAYS = 7
+REORDER_WINDOW_DAYS = 56
+REORDER_LEAD_DAYS = 7
+REORDER_REVIEW_DAYS = 7
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size = {MMAP_SIZE}",
+    f"PRAGMA cache_size = -{CACHE_SIZE_KB}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def resource(fn):
+    # One shared instance per argument tuple for the whole process, like
+    # st.cache_resource but importable without Streamlit; .clear() drops them.
+    instances = {}
+    lock = threading.RLock()
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        with lock:
+            if args not in instances:
+                instances[args] = fn(*args)
+            return instances[args]
+
+    wrapper.clear = instances.clear
+    return wrapper
+
+
+def open_connection(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        return open_connection(self.path)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Không lấy được kết nối CSDL sau {self.timeout}s") from None
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put_nowait(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+@resource
+def get_pool(path):
+    return ConnectionPool(path)
+
+
+@contextmanager
+def get_conn():
+    pool = get_pool(DB_PATH)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+READ_TABLES_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)", re.IGNORECASE)
+WRITE_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)"
+    r"\s+([A-Za-z_]\w*)",
+    re.IGNORECASE,
+)
+
+
+def read_tables(query):
+    return frozenset(name.lower() for name in READ_TABLES_RE.findall(query))
+
+
+def written_tables(query):
+    match = WRITE_TABLE_RE.match(query)
+    return frozenset([match.group(1).lower()]) if match else None
+
+
+class WriteQueue:
+    def __init__(self, path, max_batch=WRITE_BATCH_MAX):
+        self.path = path
+        self.max_batch = max_batch
+        self.batches = 0
+        self.jobs = 0
+        # This connection's data_version as of the last commit reported to the cache.
+        self._data_version = None
+        self._queue = queue.Queue()
+        # Opened here so a bad path fails the caller instead of leaving run() waiting
+        # on a writer thread that never started.
+        conn = open_connection(path)
+        self._thread = threading.Thread(
+            target=self._run, args=(conn,), name="sqlite-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    def _run(self, conn):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit_batch(conn, batch)
+
+    def _commit_batch(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = fn(conn, *args)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, None, exc))
+                else:
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, result, None))
+            # Read while the write lock is held: no other connection can commit
+            # between this and our commit, which leaves it unchanged.
+            before = conn.execute("PRAGMA data_version").fetchone()[0]
+            conn.commit()
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        # Callers drop the tables they wrote; the cache only needs a full clear
+        # if some other connection committed too.
+        self._data_version = get_query_cache(self.path).writer_committed(
+            conn, before, self._data_version
+        )
+        self.batches += 1
+        self.jobs += len(outcomes)
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+@resource
+def get_writer(path):
+    return WriteQueue(path)
+
+
+def run_write(fn, *args):
+    return get_writer(DB_PATH).run(fn, *args)
+
+
+class QueryCache:
+    def __init__(
+        self, path, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Bumped whenever entries are dropped; a fill started before the bump is stale.
+        self.generation = 0
+        self._lock = threading.Lock()
+        # PRAGMA data_version on a connection that never writes changes whenever
+        # any other connection commits, so writes we did not see still invalidate.
+        self._watch = sqlite3.connect(path, check_same_thread=False)
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self):
+        return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    @staticmethod
+    def make_key(query, params):
+        if isinstance(params, dict):
+            return query, tuple(sorted(params.items()))
+        return query, tuple(params or ())
+
+    def _sync(self):
+        # Any commit not accounted for by writer_committed() drops everything;
+        # the version only advances together with that clear.
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            self._clear()
+            self._data_version = data_version
+
+    def get(self, key):
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[2]
+
+    def put(self, key, df, tables, generation):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return size
+        with self._lock:
+            self._sync()
+            if generation != self.generation:
+                return size
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (df, tables, size)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return size
+
+    def writer_committed(self, conn, before, last):
+        # conn's own commits never change its data_version, so a change since
+        # `last` (its value at the previous report) means another connection or
+        # process committed too and its tables are unknown. Called on the writer
+        # thread; returns the value to pass as `last` next time.
+        with self._lock:
+            try:
+                data_version = self._read_data_version()
+                # Read after the watch connection, so any commit it saw shows here.
+                after = conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                self._clear()
+                return None
+            if last != before or after != before:
+                self._clear()
+            self._data_version = data_version
+            return after
+
+    def invalidate(self, tables=None):
+        with self._lock:
+            if tables is None:
+                self._clear()
+                self._data_version = self._read_data_version()
+            else:
+                tables = {name.lower() for name in tables}
+                for key in [k for k, entry in self._entries.items() if entry[1] & tables]:
+                    self._bytes -= self._entries.pop(key)[2]
+                self.generation += 1
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+@resource
+def get_query_cache(path):
+    return QueryCache(path)
+
+
+def normalize_text(text):
+    if not text:
+        return ""
+    text = str(text).replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text).split())
+
+
+def normalize_phone(phone):
+    digits = re.sub(r"\D", "", str(phone or ""))
+    if digits.startswith("84") and len(digits) >= 11:
+        digits = "0" + digits[2:]
+    elif len(digits) == 9 and not digits.startswith("0"):
+        # Phone numbers typed into Excel as numbers lose their leading zero.
+        digits = "0" + digits
+    return digits or None
+
+
+def normalize_text_series(series):
+    text = series.astype("string").fillna("").str.replace("đ", "d").str.replace("Đ", "D")
+    text = text.str.normalize("NFD").str.replace(r"[\u0300-\u036f]", "", regex=True).str.lower()
+    return text.str.replace(r"[^0-9a-z]+", " ", regex=True).str.strip()
+
+
+def normalize_phone_series(series):
+    digits = series.astype("string").str.replace(r"\D", "", regex=True)
+    digits = digits.str.replace(r"^84(\d{9,})$", r"0\1", regex=True)
+    digits = digits.str.replace(r"^([1-9]\d{8})$", r"0\1", regex=True)
+    return digits.mask(digits == "")
+
+
+def customer_row(name, phone, email, address, created_at=None):
+    return (
+        name,
+        phone,
+        email,
+        address,
+        created_at or date.today().isoformat(),
+        normalize_text(name),
+        normalize_phone(phone),
+    )
+
+
+def add_customer_search_keys(conn):
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(customers)")}
+    if "name_key" not in columns:
+        conn.execute("ALTER TABLE customers ADD COLUMN name_key TEXT")
+    if "phone_key" not in columns:
+        conn.execute("ALTER TABLE customers ADD COLUMN phone_key TEXT")
+    rows = conn.execute("SELECT id, name, phone FROM customers").fetchall()
+    conn.executemany(
+        "UPDATE customers SET name_key = ?, phone_key = ? WHERE id = ?",
+        [(normalize_text(r["name"]), normalize_phone(r["phone"]), r["id"]) for r in rows],
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_name_key ON customers(name_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_phone_key ON customers(phone_key)")
+
+
+class QueryProfiler:
+    def __init__(self, max_records=PROFILE_MAX_RECORDS, slow_ms=SLOW_QUERY_MS, log_path=None):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.records = deque(maxlen=max_records)
+        self.slow = deque(maxlen=200)
+        self.runs = deque(maxlen=500)
+        self.fallbacks = deque(maxlen=200)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def rerun(self, section):
+        run = {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "section": section,
+            "statements": 0,
+            "db_ms": 0.0,
+            "rows": 0,
+            "bytes": 0,
+            "cache_hits": 0,
+            "object_frames": 0,
+        }
+        self._local.run = run
+        start = time.perf_counter()
+        try:
+            yield run
+        finally:
+            run["wall_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            run["db_ms"] = round(run["db_ms"], 3)
+            self._local.run = None
+            with self._lock:
+                self.runs.append(run)
+
+    @property
+    def section(self):
+        run = getattr(self._local, "run", None)
+        return run["section"] if run else None
+
+    def record(self, kind, query, params, ms, rows=0, nbytes=0, cached=False, error=None):
+        run = getattr(self._local, "run", None)
+        record = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "kind": kind,
+            "sql": " ".join(query.split()),
+            "params": repr(params)[:200] if params else None,
+            "ms": round(ms, 3),
+            "rows": rows,
+            "bytes": nbytes,
+            "cached": cached,
+            "section": run["section"] if run else None,
+            "error": error,
+        }
+        if run is not None:
+            run["statements"] += 1
+            run["db_ms"] += ms
+            run["rows"] += rows
+            run["bytes"] += nbytes
+            run["cache_hits"] += int(cached)
+        if not cached and ms >= self.slow_ms and not query.lstrip().startswith("--"):
+            record["plan"] = explain_query_plan(query, params)
+        with self._lock:
+            self.records.append(record)
+            if "plan" in record:
+                self.slow.append(record)
+            self._log(record)
+
+    def object_fallback(self, query, column, error):
+        run = getattr(self._local, "run", None)
+        record = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "kind": "object_frame",
+            "sql": " ".join(query.split()),
+            "column": column,
+            "error": f"{type(error).__name__}: {error}"[:200],
+            "section": run["section"] if run else None,
+        }
+        if run is not None:
+            run["object_frames"] += 1
+        with self._lock:
+            self.fallbacks.append(record)
+            self._log(record)
+
+    def _log(self, record):
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def export_jsonl(self):
+        with self._lock:
+            records = list(self.records)
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
+            self.slow.clear()
+            self.runs.clear()
+            self.fallbacks.clear()
+
+
+@resource
+def get_profiler():
+    return QueryProfiler(log_path=PROFILE_LOG_PATH)
+
+
+def explain_query_plan(query, params):
+    try:
+        with get_conn() as conn:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + query, params or []).fetchall()
+    except sqlite3.Error as exc:
+        return [f"EXPLAIN thất bại: {exc}"]
+    return [row["detail"] for row in rows]
+
+
+@contextmanager
+def profiled(kind, query, params=None):
+    stat = {"rows": 0, "nbytes": 0, "cached": False}
+    start = time.perf_counter()
+    try:
+        yield stat
+    except BaseException as exc:
+        stat["error"] = type(exc).__name__
+        raise
+    finally:
+        get_profiler().record(kind, query, params, (time.perf_counter() - start) * 1000, **stat)
+
+
+SALES_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day TEXT PRIMARY KEY,
+    orders INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS daily_product_sales (
+    day TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, product_id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS daily_sales_order_insert AFTER INSERT ON orders BEGIN
+    INSERT INTO daily_sales (day, orders, revenue) VALUES (new.order_date, 1, new.total)
+    ON CONFLICT(day) DO UPDATE SET
+        orders = orders + 1, revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS daily_sales_order_delete AFTER DELETE ON orders BEGIN
+    UPDATE daily_sales SET orders = orders - 1, revenue = revenue - old.total
+    WHERE day = old.order_date;
+END;
+CREATE TRIGGER IF NOT EXISTS daily_sales_order_update
+AFTER UPDATE OF order_date, total ON orders BEGIN
+    UPDATE daily_sales SET orders = orders - 1, revenue = revenue - old.total
+    WHERE day = old.order_date;
+    INSERT INTO daily_sales (day, orders, revenue) VALUES (new.order_date, 1, new.total)
+    ON CONFLICT(day) DO UPDATE SET
+        orders = orders + 1, revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS daily_product_sales_move
+AFTER UPDATE OF order_date ON orders WHEN new.order_date != old.order_date BEGIN
+    UPDATE daily_product_sales SET
+        qty = qty - (SELECT SUM(i.qty) FROM order_items i
+                     WHERE i.order_id = old.id AND i.product_id = daily_product_sales.product_id),
+        revenue = revenue - (SELECT SUM(i.qty * i.price) FROM order_items i
+                             WHERE i.order_id = old.id AND i.product_id = daily_product_sales.product_id)
+    WHERE day = old.order_date
+      AND product_id IN (SELECT product_id FROM order_items WHERE order_id = old.id);
+    INSERT INTO daily_product_sales (day, product_id, qty, revenue)
+    SELECT new.order_date, product_id, SUM(qty), SUM(qty * price)
+    FROM order_items WHERE order_id = new.id GROUP BY product_id
+    ON CONFLICT(day, product_id) DO UPDATE SET
+        qty = qty + excluded.qty, revenue = revenue + excluded.revenue;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_product_sales_item_insert AFTER INSERT ON order_items BEGIN
+    INSERT INTO daily_product_sales (day, product_id, qty, revenue)
+    SELECT order_date, new.product_id, new.qty, new.qty * new.price
+    FROM orders WHERE id = new.order_id
+    ON CONFLICT(day, product_id) DO UPDATE SET
+        qty = qty + excluded.qty, revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS daily_product_sales_item_delete AFTER DELETE ON order_items BEGIN
+    UPDATE daily_product_sales SET
+        qty = qty - old.qty, revenue = revenue - old.qty * old.price
+    WHERE product_id = old.product_id
+      AND day = (SELECT order_date FROM orders WHERE id = old.order_id);
+END;
+CREATE TRIGGER IF NOT EXISTS daily_product_sales_item_update
+AFTER UPDATE OF product_id, qty, price ON order_items BEGIN
+    UPDATE daily_product_sales SET
+        qty = qty - old.qty, revenue = revenue - old.qty * old.price
+    WHERE product_id = old.product_id
+      AND day = (SELECT order_date FROM orders WHERE id = old.order_id);
+    INSERT INTO daily_product_sales (day, product_id, qty, revenue)
+    SELECT order_date, new.product_id, new.qty, new.qty * new.price
+    FROM orders WHERE id = new.order_id
+    ON CONFLICT(day, product_id) DO UPDATE SET
+        qty = qty + excluded.qty, revenue = revenue + excluded.revenue;
+END;
+"""
+
+SALES_ROLLUPS = {
+    "daily_sales": {
+        "source": """
+            SELECT order_date AS day, COUNT(*) AS orders, SUM(total) AS revenue
+            FROM {orders}
+            GROUP BY order_date
+        """,
+        "compare": "day, orders, ROUND(revenue, 2)",
+        "live": "orders != 0 OR ROUND(revenue, 2) != 0",
+    },
+    "daily_product_sales": {
+        "source": """
+            SELECT o.order_date AS day, i.product_id, SUM(i.qty) AS qty,
+                   SUM(i.qty * i.price) AS revenue
+            FROM {order_items} i
+            JOIN {orders} o ON o.id = i.order_id
+            GROUP BY o.order_date, i.product_id
+        """,
+        "compare": "day, product_id, qty, ROUND(revenue, 2)",
+        "live": "qty != 0 OR ROUND(revenue, 2) != 0",
+    },
+}
+
+
+def rollup_source(rollup, archived):
+    # Archived orders still count: read them through the all-years views.
+    if archived:
+        return rollup["source"].format(orders="all_orders", order_items="all_order_items")
+    return rollup["source"].format(orders="orders", order_items="order_items")
+
+
+def rebuild_sales_rollups(conn, archived=False):
+    for table, rollup in SALES_ROLLUPS.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} SELECT * FROM ({rollup_source(rollup, archived)})")
+
+
+def verify_sales_rollups(conn, archived=False):
+    mismatches = {}
+    for table, rollup in SALES_ROLLUPS.items():
+        compare, source = rollup["compare"], rollup_source(rollup, archived)
+        # Revenue is compared rounded: incremental sums drift in the last float bits.
+        rows = conn.execute(
+            f"""
+            SELECT 'thiếu' AS issue, * FROM (
+                SELECT {compare} FROM ({source})
+                EXCEPT
+                SELECT {compare} FROM {table}
+            )
+            UNION ALL
+            SELECT 'thừa' AS issue, * FROM (
+                SELECT {compare} FROM {table} WHERE {rollup["live"]}
+                EXCEPT
+                SELECT {compare} FROM ({source})
+            )
+            """
+        ).fetchall()
+        if rows:
+            mismatches[table] = [tuple(row) for row in rows]
+    return mismatches
+
+
+def create_sales_rollups(conn):
+    for statement in split_sql(SALES_ROLLUP_SCHEMA):
+        conn.execute(statement)
+    rebuild_sales_rollups(conn)
+
+
+STOCK_MOVEMENT_KINDS = {
+    "sale": "Bán hàng",
+    "import": "Nhập hàng",
+    "adjustment": "Điều chỉnh",
+    "return": "Trả hàng",
+    "opening": "Tồn đầu kỳ",
+}
+
+STOCK_LEDGER_TABLES = f"""
+CREATE TABLE IF NOT EXISTS stock_movements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ({", ".join(f"'{kind}'" for kind in STOCK_MOVEMENT_KINDS)})),
+    order_id INTEGER,
+    note TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stock_movements_product ON stock_movements(product_id, day);
+CREATE INDEX IF NOT EXISTS idx_stock_movements_day ON stock_movements(day, product_id, qty);
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    day TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    stock INTEGER NOT NULL,
+    PRIMARY KEY (day, product_id)
+) WITHOUT ROWID;
+"""
+
+# products.stock is the running balance of the ledger; snapshots taken before a
+# back-dated movement are corrected in place so they stay end-of-day balances.
+STOCK_LEDGER_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS stock_movements_apply AFTER INSERT ON stock_movements BEGIN
+    UPDATE products SET stock = stock + new.qty WHERE id = new.product_id;
+END;
+CREATE TRIGGER IF NOT EXISTS stock_movements_backdated AFTER INSERT ON stock_movements
+WHEN new.day <= (SELECT MAX(day) FROM stock_snapshots) BEGIN
+    INSERT INTO stock_snapshots (day, product_id, stock)
+    SELECT DISTINCT day, new.product_id, 0 FROM stock_snapshots WHERE day >= new.day
+    ON CONFLICT DO NOTHING;
+    UPDATE stock_snapshots SET stock = stock + new.qty
+    WHERE product_id = new.product_id AND day >= new.day;
+END;
+CREATE TRIGGER IF NOT EXISTS products_keep_sold BEFORE DELETE ON products
+WHEN EXISTS (SELECT 1 FROM order_items WHERE product_id = old.id) BEGIN
+    SELECT RAISE(ABORT, 'product has order items');
+END;
+CREATE TRIGGER IF NOT EXISTS products_delete_stock AFTER DELETE ON products BEGIN
+    DELETE FROM stock_movements WHERE product_id = old.id;
+    DELETE FROM stock_snapshots WHERE product_id = old.id;
+END;
+"""
+
+
+def take_stock_snapshot(conn, day):
+    previous = conn.execute(
+        "SELECT MAX(day) FROM stock_snapshots WHERE day < ?", (day,)
+    ).fetchone()[0]
+    conn.execute("DELETE FROM stock_snapshots WHERE day = ?", (day,))
+    conn.execute(
+        """
+        INSERT INTO stock_snapshots (day, product_id, stock)
+        SELECT ?1, product_id, SUM(qty) FROM (
+            SELECT product_id, stock AS qty FROM stock_snapshots WHERE day = ?2
+            UNION ALL
+            SELECT product_id, qty FROM stock_movements
+            WHERE day > COALESCE(?2, '') AND day <= ?1
+        )
+        GROUP BY product_id
+        HAVING SUM(qty) != 0
+        """,
+        (day, previous),
+    )
+
+
+def backfill_stock_snapshots(conn):
+    # Month-end snapshots over existing history bound the delta scan for past dates.
+    first = conn.execute("SELECT MIN(day) FROM stock_movements").fetchone()[0]
+    yesterday = date.today() - timedelta(days=1)
+    if first is None or first > yesterday.isoformat():
+        return
+    month = date.fromisoformat(first[:10]).replace(day=1)
+    while True:
+        month = (month + timedelta(days=32)).replace(day=1)
+        month_end = month - timedelta(days=1)
+        if month_end >= yesterday:
+            break
+        take_stock_snapshot(conn, month_end.isoformat())
+    take_stock_snapshot(conn, yesterday.isoformat())
+
+
+def verify_stock_ledger(conn):
+    rows = conn.execute(
+        """
+        SELECT p.id, p.stock, COALESCE(m.qty, 0)
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, SUM(qty) AS qty FROM stock_movements GROUP BY product_id
+        ) m ON m.product_id = p.id
+        WHERE p.stock != COALESCE(m.qty, 0)
+        """
+    ).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def create_stock_ledger(conn):
+    for statement in split_sql(STOCK_LEDGER_TABLES):
+        conn.execute(statement)
+    # Seed from history before the triggers exist, so products.stock is untouched:
+    # one sale movement per order line and an opening balance that nets to today's stock.
+    now = datetime.now().isoformat(timespec="seconds")
+    conn.execute(
+        """
+        INSERT INTO stock_movements (product_id, day, qty, kind, order_id, created_at)
+        SELECT i.product_id, o.order_date, -SUM(i.qty), 'sale', o.id, ?
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        GROUP BY o.id, i.product_id
+        """,
+        (now,),
+    )
+    conn.execute(
+        """
+        INSERT INTO stock_movements (product_id, day, qty, kind, note, created_at)
+        SELECT p.id, MIN(substr(p.created_at, 1, 10), COALESCE(m.first_day, '9999')),
+               p.stock - COALESCE(m.qty, 0), 'opening', 'Số dư khi tạo sổ kho', ?
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, MIN(day) AS first_day, SUM(qty) AS qty
+            FROM stock_movements GROUP BY product_id
+        ) m ON m.product_id = p.id
+        WHERE p.stock - COALESCE(m.qty, 0) != 0
+        """,
+        (now,),
+    )
+    backfill_stock_snapshots(conn)
+    for statement in split_sql(STOCK_LEDGER_TRIGGERS):
+        conn.execute(statement)
+
+
+# Archival moves orders out of the hot database without touching the rollups:
+# while a row is in `archiving`, the delete triggers leave daily sales alone.
+ARCHIVE_GUARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archiving (year INTEGER NOT NULL);
+DROP TRIGGER IF EXISTS daily_sales_order_delete;
+CREATE TRIGGER daily_sales_order_delete AFTER DELETE ON orders
+WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+    UPDATE daily_sales SET orders = orders - 1, revenue = revenue - old.total
+    WHERE day = old.order_date;
+END;
+DROP TRIGGER IF EXISTS daily_product_sales_item_delete;
+CREATE TRIGGER daily_product_sales_item_delete AFTER DELETE ON order_items
+WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+    UPDATE daily_product_sales SET
+        qty = qty - old.qty, revenue = revenue - old.qty * old.price
+    WHERE product_id = old.product_id
+      AND day = (SELECT order_date FROM orders WHERE id = old.order_id);
+END;
+DROP TRIGGER IF EXISTS products_keep_sold;
+CREATE TRIGGER products_keep_sold BEFORE DELETE ON products
+WHEN EXISTS (SELECT 1 FROM order_items WHERE product_id = old.id)
+  OR EXISTS (SELECT 1 FROM stock_movements WHERE product_id = old.id AND kind = 'sale') BEGIN
+    SELECT RAISE(ABORT, 'product has order items');
+END;
+"""
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {db}.orders (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    order_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS {db}.order_items (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL,
+    price REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {db}.idx_orders_date_total ON orders(order_date, total);
+CREATE INDEX IF NOT EXISTS {db}.idx_orders_customer ON orders(customer_id);
+CREATE INDEX IF NOT EXISTS {db}.idx_order_items_order
+    ON order_items(order_id, product_id, qty, price);
+CREATE INDEX IF NOT EXISTS {db}.idx_order_items_product ON order_items(product_id, qty, price);
+"""
+
+# Temp views over the hot table and every attached sales_YYYY.db. SQLite only pushes
+# filters into them from a non-join subquery, so joins wrap the view in one; queries
+# that must stream in index order use a {db} prefix and run once per file instead.
+ARCHIVE_VIEWS = {"all_orders": "orders", "all_order_items": "order_items"}
+
+
+def archive_path(year):
+    base, ext = os.path.splitext(DB_PATH)
+    return f"{base}_{year}{ext or '.db'}"
+
+
+def archive_years():
+    base, ext = os.path.splitext(DB_PATH)
+    folder, prefix = os.path.split(base)
+    pattern = re.compile(re.escape(prefix) + r"_(\d{4})" + re.escape(ext or ".db") + "$")
+    try:
+        names = os.listdir(folder or ".")
+    except FileNotFoundError:
+        return []
+    return sorted(int(match.group(1)) for match in map(pattern.match, names) if match)
+
+
+def archive_prefixes():
+    # Oldest archive first and the hot database last, so per-file results stay chronological.
+    return [f"archive_{year}." for year in archive_years()] + [""]
+
+
+def reads_archives(tables):
+    return bool(tables & ARCHIVE_VIEWS.keys()) or any(t.startswith("archive_") for t in tables)
+
+
+def attach_archive(conn, year, create=False):
+    name = f"archive_{year}"
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if name not in attached:
+        conn.execute(f"ATTACH DATABASE ? AS {name}", (archive_path(year),))
+    if create:
+        conn.execute(f"PRAGMA {name}.journal_mode = WAL")
+        for statement in split_sql(ARCHIVE_SCHEMA.format(db=name)):
+            conn.execute(statement)
+    return name
+
+
+def ensure_archives(conn):
+    # Attach archives on demand; views are rebuilt when a new year file appears.
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    years = archive_years()
+    missing = [year for year in years if f"archive_{year}" not in attached]
+    for year in missing:
+        attach_archive(conn, year)
+    has_views = conn.execute(
+        "SELECT 1 FROM sqlite_temp_master WHERE type = 'view' AND name = 'all_orders'"
+    ).fetchone()
+    if has_views and not missing:
+        return
+    for view, table in ARCHIVE_VIEWS.items():
+        parts = [f"SELECT * FROM main.{table}"]
+        parts += [f"SELECT * FROM archive_{year}.{table}" for year in years]
+        conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+        conn.execute(f"CREATE TEMP VIEW {view} AS " + " UNION ALL ".join(parts))
+
+
+# Client order ids from POS terminals stay in the hot database even after the
+# orders themselves are archived, so a resent batch is still recognised.
+CLIENT_ORDERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS client_orders (
+    client_order_id TEXT PRIMARY KEY,
+    order_id INTEGER NOT NULL,
+    received_at TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Per-customer totals folded in from orders above last_order_id, and their scores.
+# Archiving never touches it, so lifetime figures survive old orders moving out.
+CUSTOMER_STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customer_stats (
+    customer_id INTEGER PRIMARY KEY,
+    orders INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    first_order TEXT NOT NULL,
+    last_order TEXT NOT NULL,
+    r_score INTEGER NOT NULL DEFAULT 0,
+    f_score INTEGER NOT NULL DEFAULT 0,
+    m_score INTEGER NOT NULL DEFAULT 0,
+    rfm_score INTEGER NOT NULL DEFAULT 0,
+    segment TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_customer_stats_rank ON customer_stats(rfm_score, revenue);
+CREATE INDEX IF NOT EXISTS idx_customer_stats_segment
+    ON customer_stats(segment, rfm_score, revenue);
+CREATE TABLE IF NOT EXISTS customer_stats_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_order_id INTEGER NOT NULL,
+    customers INTEGER NOT NULL,
+    repeat_customers INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    refreshed_at TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS customers_delete_stats AFTER DELETE ON customers BEGIN
+    DELETE FROM customer_stats WHERE customer_id = old.id;
+END;
+"""
+
+
+SCHEMA_MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        sku TEXT UNIQUE,
+        price REAL NOT NULL,
+        stock INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT,
+        email TEXT,
+        address TEXT,
+        created_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        order_date TEXT NOT NULL,
+        status TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        FOREIGN KEY (customer_id) REFERENCES customers(id)
+    );
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL,
+        price REAL NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders(id),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_orders_date_total ON orders(order_date, total);
+    CREATE INDEX IF NOT EXISTS idx_order_items_order
+        ON order_items(order_id, product_id, qty, price);
+    CREATE INDEX IF NOT EXISTS idx_order_items_product
+        ON order_items(product_id, qty, price);
+    CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name);
+    CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock, name, sku);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, sku, content='products', content_rowid='id', tokenize='trigram'
+    );
+    INSERT INTO products_fts(products_fts) VALUES ('rebuild');
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, sku) VALUES (new.id, new.name, new.sku);
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, sku)
+        VALUES ('delete', old.id, old.name, old.sku);
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, sku ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, sku)
+        VALUES ('delete', old.id, old.name, old.sku);
+        INSERT INTO products_fts(rowid, name, sku) VALUES (new.id, new.name, new.sku);
+    END;
+    """,
+    add_customer_search_keys,
+    """
+    CREATE INDEX IF NOT EXISTS idx_customers_email ON customers(lower(email));
+    """,
+    create_sales_rollups,
+    create_stock_ledger,
+    ARCHIVE_GUARD_SCHEMA,
+    CLIENT_ORDERS_SCHEMA,
+    CUSTOMER_STATS_SCHEMA,
+]
+
+
+def split_sql(script):
+    statements = []
+    current = ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    applied = []
+    for version, migration in enumerate(SCHEMA_MIGRATIONS, start=1):
+        if get_schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock.
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            if callable(migration):
+                migration(conn)
+            else:
+                for statement in split_sql(migration):
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def init_db():
+    with get_conn() as conn:
+        return migrate(conn)
+
+
+WALKIN_NAME = "Khách lẻ"
+
+SQL_WALKIN_CUSTOMER = "SELECT id FROM customers WHERE name = ? LIMIT 1"
+
+SQL_INSERT_CUSTOMER = """
+INSERT INTO customers (name, phone, email, address, created_at, name_key, phone_key)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_CUSTOMER_BY_PHONE = """
+SELECT id, name, phone FROM customers
+WHERE phone_key GLOB ? AND name != ?
+ORDER BY phone_key
+LIMIT ?
+"""
+
+SQL_CUSTOMER_BY_NAME = """
+SELECT id, name, phone FROM customers
+WHERE name_key GLOB ? AND name != ?
+ORDER BY name_key
+LIMIT ?
+"""
+
+SQL_INVENTORY = """
+SELECT name AS 'Sản phẩm', sku AS 'SKU', price AS 'Giá bán', stock AS 'Tồn kho'
+FROM products
+"""
+
+SQL_LOW_STOCK = """
+SELECT name AS 'Sản phẩm', sku AS 'SKU', stock AS 'Tồn kho'
+FROM products
+WHERE stock <= ?
+"""
+
+# Stock at the end of day ?1: the latest snapshot on or before it plus the
+# movements dated after that snapshot.
+STOCK_AS_OF_CTE = """
+WITH snap AS (SELECT MAX(day) AS day FROM stock_snapshots WHERE day <= ?1),
+moved AS (
+    SELECT product_id, SUM(qty) AS qty
+    FROM stock_movements
+    WHERE day > COALESCE((SELECT day FROM snap), '') AND day <= ?1
+    GROUP BY product_id
+),
+stock_as_of AS (
+    SELECT p.name, p.sku, p.price, COALESCE(s.stock, 0) + COALESCE(m.qty, 0) AS stock
+    FROM products p
+    LEFT JOIN stock_snapshots s ON s.day = (SELECT day FROM snap) AND s.product_id = p.id
+    LEFT JOIN moved m ON m.product_id = p.id
+)
+"""
+
+SQL_INVENTORY_AS_OF = STOCK_AS_OF_CTE + """
+SELECT name AS 'Sản phẩm', sku AS 'SKU', price AS 'Giá bán', stock AS 'Tồn kho'
+FROM stock_as_of
+"""
+
+SQL_LOW_STOCK_AS_OF = STOCK_AS_OF_CTE + """
+SELECT name AS 'Sản phẩm', sku AS 'SKU', stock AS 'Tồn kho'
+FROM stock_as_of
+WHERE stock <= ?2
+"""
+
+SQL_STOCK_HISTORY = """
+SELECT day AS 'Ngày', kind AS 'Loại', qty AS 'Số lượng', order_id AS 'Mã đơn',
+       note AS 'Ghi chú', created_at AS 'Ghi lúc'
+FROM stock_movements
+WHERE product_id = ?
+ORDER BY day DESC, id DESC
+LIMIT ?
+"""
+
+SQL_INSERT_MOVEMENT = """
+INSERT INTO stock_movements (product_id, day, qty, kind, order_id, note, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_INVOICE_ITEMS = """
+SELECT p.name AS 'Sản phẩm', i.qty AS 'Số lượng',
+       i.price AS 'Đơn giá', (i.qty * i.price) AS 'Thành tiền'
+FROM (SELECT product_id, qty, price FROM all_order_items WHERE order_id = ?) i
+JOIN products p ON i.product_id = p.id
+"""
+
+SQL_INVOICE_HEADERS = """
+SELECT o.id, o.order_date, o.status, o.total,
+       c.name AS customer, c.phone, c.email, c.address
+FROM (SELECT * FROM all_orders WHERE id IN (SELECT value FROM json_each(?))) o
+JOIN customers c ON o.customer_id = c.id
+"""
+
+SQL_INVOICE_LINES = """
+SELECT i.id, i.order_id, p.sku, p.name, i.qty, i.price
+FROM (SELECT * FROM all_order_items WHERE order_id IN (SELECT value FROM json_each(?))) i
+JOIN products p ON i.product_id = p.id
+"""
+
+SQL_INVOICE_IDS = """
+SELECT id FROM all_orders
+WHERE order_date BETWEEN ? AND ?
+ORDER BY id
+"""
+
+SQL_REVENUE_BY_DAY = """
+SELECT day AS 'Ngày', orders AS 'Số đơn', revenue AS 'Doanh thu'
+FROM daily_sales
+WHERE day BETWEEN ? AND ? AND orders > 0
+ORDER BY day
+"""
+
+SQL_PRODUCT_SALES = """
+SELECT p.name AS 'Sản phẩm', SUM(d.qty) AS 'Số lượng bán',
+       SUM(d.revenue) AS 'Doanh thu'
+FROM daily_product_sales d
+JOIN products p ON d.product_id = p.id
+WHERE d.day BETWEEN ? AND ?
+GROUP BY d.product_id
+HAVING SUM(d.qty) > 0
+ORDER BY SUM(d.qty) DESC
+"""
+
+SQL_TOP_PRODUCTS = SQL_PRODUCT_SALES + "LIMIT 10\n"
+
+SQL_EXPORT_ORDER_LINES = """
+SELECT o.id AS 'Mã đơn', o.order_date AS 'Ngày', c.name AS 'Khách hàng',
+       o.status AS 'Trạng thái', p.sku AS 'SKU', p.name AS 'Sản phẩm',
+       i.qty AS 'Số lượng', i.price AS 'Đơn giá', (i.qty * i.price) AS 'Thành tiền',
+       o.total AS 'Tổng đơn'
+FROM {db}orders o
+JOIN customers c ON o.customer_id = c.id
+JOIN {db}order_items i ON i.order_id = o.id
+JOIN products p ON i.product_id = p.id
+WHERE o.order_date BETWEEN ? AND ?
+ORDER BY o.order_date, o.id, i.id
+"""
+
+SQL_PRODUCT_BY_SKU = "SELECT id, name, sku, price, stock FROM products WHERE sku = ?"
+
+SQL_PRODUCT_FTS = """
+SELECT p.id, p.name, p.sku, p.price, p.stock
+FROM products_fts f
+JOIN products p ON p.id = f.rowid
+WHERE products_fts MATCH ?
+ORDER BY f.rank
+LIMIT ?
+"""
+
+
+SQL_CUSTOMER_ORDERS_DELTA = """
+SELECT customer_id, COUNT(*) AS orders, SUM(total) AS revenue,
+       MIN(order_date) AS first_order, MAX(order_date) AS last_order
+FROM {db}orders
+WHERE id > ? AND id <= ? AND customer_id NOT IN (SELECT id FROM customers WHERE name = ?)
+GROUP BY customer_id
+"""
+
+# Additive, so rows for one customer from several year files fold in one after another.
+SQL_UPSERT_CUSTOMER_STATS = """
+INSERT INTO customer_stats (customer_id, orders, revenue, first_order, last_order)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(customer_id) DO UPDATE SET
+    orders = orders + excluded.orders,
+    revenue = revenue + excluded.revenue,
+    first_order = MIN(first_order, excluded.first_order),
+    last_order = MAX(last_order, excluded.last_order)
+"""
+
+SQL_UPDATE_CUSTOMER_SCORES = """
+UPDATE customer_stats SET r_score = ?, f_score = ?, m_score = ?, rfm_score = ?, segment = ?
+WHERE customer_id = ?
+"""
+
+# CROSS JOIN keeps customer_stats outermost, so pages walk the score index in order.
+SQL_CUSTOMER_STATS = """
+SELECT s.customer_id AS id, c.name, c.phone, s.orders, s.revenue,
+       ROUND(s.revenue / s.orders) AS avg_order, s.first_order, s.last_order,
+       CAST(julianday(?) - julianday(s.last_order) AS INTEGER) AS recency_days,
+       s.r_score, s.f_score, s.m_score, s.rfm_score, s.segment
+FROM customer_stats s
+CROSS JOIN customers c ON c.id = s.customer_id
+"""
+
+SQL_CUSTOMER_SEGMENTS = """
+SELECT segment AS "Nhóm", COUNT(*) AS "Số khách", SUM(revenue) AS "Doanh thu"
+FROM customer_stats
+GROUP BY segment
+ORDER BY SUM(revenue) DESC
+"""
+
+# Queries that must be served by an index; see check_query_plans().
+INDEXED_QUERIES = {
+    "walkin_customer": (SQL_WALKIN_CUSTOMER, (WALKIN_NAME,)),
+    "low_stock": (SQL_LOW_STOCK, (10,)),
+    "stock_history": (SQL_STOCK_HISTORY, (1, 50)),
+    "invoice_items": (SQL_INVOICE_ITEMS, (1,)),
+    "revenue_by_day": (SQL_REVENUE_BY_DAY, ("2000-01-01", "2000-01-31")),
+    "top_products": (SQL_TOP_PRODUCTS, ("2000-01-01", "2000-01-31")),
+    "export_order_lines": (SQL_EXPORT_ORDER_LINES, ("2000-01-01", "2000-01-31")),
+    "invoice_headers": (SQL_INVOICE_HEADERS, ("[1, 2]",)),
+    "invoice_lines": (SQL_INVOICE_LINES, ("[1, 2]",)),
+    "invoice_ids": (SQL_INVOICE_IDS, ("2000-01-01", "2000-01-31")),
+    "product_by_sku": (SQL_PRODUCT_BY_SKU, ("SKU00001",)),
+    "product_search": (SQL_PRODUCT_FTS, ('"abc"', PRODUCT_LOOKUP_LIMIT)),
+    "customer_by_phone": (SQL_CUSTOMER_BY_PHONE, ("090*", WALKIN_NAME, CUSTOMER_LOOKUP_LIMIT)),
+    "customer_by_name": (SQL_CUSTOMER_BY_NAME, ("ng*", WALKIN_NAME, CUSTOMER_LOOKUP_LIMIT)),
+    "customer_orders_delta": (SQL_CUSTOMER_ORDERS_DELTA, (0, 100, WALKIN_NAME)),
+    "customer_stats_page": (
+        SQL_CUSTOMER_STATS + "ORDER BY s.rfm_score DESC, s.revenue DESC, s.customer_id DESC LIMIT ?",
+        ("2000-01-01", PAGE_SIZE + 1),
+    ),
+}
+
+
+# ISO day columns become real dates in UI frames; timestamps such as created_at stay text.
+DATE_COLUMNS = frozenset({"order_date", "day", "Ngày"})
+
+
+def arrow_column(name, values):
+    array = pa.array(values)
+    if pa.types.is_integer(array.type) and (name == "id" or name.endswith("_id")):
+        return array.cast(pa.int32())
+    if not pa.types.is_string(array.type):
+        return array
+    if name in DATE_COLUMNS:
+        return array.cast(pa.date32())
+    # Repeated labels (status, walk-in customer) are stored once. Small pages skip
+    # this: building the categorical costs more than it saves.
+    if len(array) >= CATEGORY_MIN_ROWS and pc.count_distinct(array).as_py() * 2 <= len(array):
+        return array.dictionary_encode()
+    return array
+
+
+def pandas_array(array):
+    if pa.types.is_dictionary(array.type):
+        return array.to_pandas().array
+    return pd.arrays.ArrowExtensionArray(array)
+
+
+def read_frame(conn, query, params=None):
+    cur = conn.execute(query, params or [])
+    names = [column[0] for column in cur.description]
+    rows = cur.fetchall()
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    arrays = []
+    for name, values in zip(names, columns):
+        try:
+            arrays.append(arrow_column(name, values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as exc:
+            # A column mixing SQLite storage classes falls back to Python objects;
+            # the profiler keeps the column so the bad data can be found.
+            get_profiler().object_fallback(query, name, exc)
+            return pd.DataFrame.from_records([tuple(row) for row in rows], columns=names)
+    df = pd.DataFrame(dict(enumerate(map(pandas_array, arrays))), copy=False)
+    df.columns = names
+    return df
+
+
+def text_or(value, default):
+    # Nullable Arrow columns give pd.NA, which cannot be tested with `or`.
+    return default if pd.isna(value) else value
+
+
+def fetch_df(query, params=None):
+    cache = get_query_cache(DB_PATH)
+    key = cache.make_key(query, params)
+    with profiled("read", query, params) as stat:
+        hit = cache.get(key)
+        if hit is None:
+            generation = cache.generation
+            tables = read_tables(query)
+            with get_conn() as conn:
+                if reads_archives(tables):
+                    ensure_archives(conn)
+                df = read_frame(conn, query, params)
+            stat["nbytes"] = cache.put(key, df, tables, generation)
+        else:
+            df, stat["nbytes"] = hit
+            stat["cached"] = True
+        stat["rows"] = len(df)
+    # Shallow copy: callers may add columns without touching the cached frame.
+    return df.copy(deep=False)
+
+
+# Tables that triggers write to as a side effect of writing the key table.
+TRIGGER_TARGETS = {
+    "products": {"products_fts", "stock_movements", "stock_snapshots"},
+    "stock_movements": {"products", "stock_snapshots"},
+    "orders": {"daily_sales", "daily_product_sales", "all_orders"},
+    "order_items": {"daily_product_sales", "all_order_items"},
+    "customers": {"customer_stats"},
+}
+
+
+def invalidate_tables(tables):
+    if tables is not None:
+        tables = set(tables)
+        for table in list(tables):
+            tables |= TRIGGER_TARGETS.get(table, set())
+    get_query_cache(DB_PATH).invalidate(tables)
+
+
+def execute_tx(conn, query, params):
+    cur = conn.execute(query, params or [])
+    return cur.lastrowid, cur.rowcount
+
+
+def execute_many_tx(conn, query, rows):
+    return conn.executemany(query, rows).rowcount
+
+
+def execute(query, params=None):
+    with profiled("write", query, params) as stat:
+        last_id, stat["rows"] = run_write(execute_tx, query, params)
+    invalidate_tables(written_tables(query))
+    return last_id
+
+
+def execute_many(query, rows):
+    rows = list(rows)
+    with profiled("write", query, rows[0] if rows else None) as stat:
+        stat["rows"] = run_write(execute_many_tx, query, rows)
+    invalidate_tables(written_tables(query))
+
+
+def walkin_customer_tx(conn):
+    row = conn.execute(SQL_WALKIN_CUSTOMER, (WALKIN_NAME,)).fetchone()
+    if row:
+        return int(row["id"]), False
+    cur = conn.execute(SQL_INSERT_CUSTOMER, customer_row(WALKIN_NAME, None, None, None))
+    return int(cur.lastrowid), True
+
+
+def get_or_create_walkin_customer_id():
+    with get_conn() as conn:
+        row = conn.execute(SQL_WALKIN_CUSTOMER, (WALKIN_NAME,)).fetchone()
+    if row:
+        return int(row["id"])
+    customer_id, created = run_write(walkin_customer_tx)
+    if created:
+        invalidate_tables({"customers"})
+    return customer_id
+
+
+@resource
+def get_walkin_customer_id(path):
+    return get_or_create_walkin_customer_id()
+
+
+def movement_row(product_id, day, qty, kind, order_id=None, note=None):
+    created_at = datetime.now().isoformat(timespec="seconds")
+    return (int(product_id), day, int(qty), kind, order_id, note, created_at)
+
+
+def check_stock(conn, product_ids):
+    # Movements have already been applied by the trigger; any negative balance fails the job.
+    product_ids = list(product_ids)
+    placeholders = ", ".join("?" * len(product_ids))
+    rows = conn.execute(
+        f"SELECT id, name, stock FROM products WHERE id IN ({placeholders})", product_ids
+    ).fetchall()
+    stock_by_id = {row["id"]: row for row in rows}
+    short = []
+    for product_id in product_ids:
+        row = stock_by_id.get(product_id)
+        if row is None or row["stock"] < 0:
+            short.append(row["name"] if row else f"ID {product_id}")
+    if short:
+        raise OutOfStockError(short)
+
+
+class OutOfStockError(Exception):
+    def __init__(self, products):
+        self.products = products
+        super().__init__("Tồn kho không đủ: " + ", ".join(products))
+
+
+def create_order_tx(conn, customer_id, order_date, items, status):
+    qty_by_product = {}
+    for item in items:
+        product_id = int(item["product_id"])
+        qty_by_product[product_id] = qty_by_product.get(product_id, 0) + int(item["qty"])
+    total = sum(float(item["price"]) * int(item["qty"]) for item in items)
+
+    cur = conn.execute(
+        "INSERT INTO orders (customer_id, order_date, status, total) VALUES (?, ?, ?, ?)",
+        (int(customer_id), order_date, status, total),
+    )
+    order_id = cur.lastrowid
+    conn.executemany(
+        "INSERT INTO order_items (order_id, product_id, qty, price) VALUES (?, ?, ?, ?)",
+        [
+            (order_id, int(item["product_id"]), int(item["qty"]), float(item["price"]))
+            for item in items
+        ],
+    )
+    conn.executemany(
+        SQL_INSERT_MOVEMENT,
+        [
+            movement_row(product_id, order_date, -qty, "sale", order_id)
+            for product_id, qty in qty_by_product.items()
+        ],
+    )
+    check_stock(conn, qty_by_product)
+    return order_id
+
+
+def create_order(customer_id, order_date, items, status="Đã tạo"):
+    with profiled("write", "-- create_order", (customer_id, len(items))) as stat:
+        order_id = run_write(create_order_tx, customer_id, order_date, items, status)
+        stat["rows"] = len(items) + 1
+    invalidate_tables({"orders", "order_items", "stock_movements"})
+    return order_id
+
+
+SQL_SALES_MOMENTS = """
+SELECT product_id, SUM(qty) AS qty, SUM(qty * qty) AS qty2
+FROM daily_product_sales
+WHERE day > ? AND day <= ?
+GROUP BY product_id
+"""
+
+# New sale movements per (product, day) with that day's rollup total after them,
+# enough to update the sum of squares without rereading the window.
+SQL_SALES_MOMENTS_DELTA = """
+SELECT m.product_id, -SUM(m.qty) AS qty, d.qty AS day_total
+FROM stock_movements m
+JOIN daily_product_sales d ON d.day = m.day AND d.product_id = m.product_id
+WHERE m.id > ? AND m.id <= ? AND m.kind = 'sale' AND m.day > ? AND m.day <= ?
+GROUP BY m.product_id, m.day
+"""
+
+
+class ReorderEngine:
+    def __init__(self, path, window_days=REORDER_WINDOW_DAYS):
+        self.path = path
+        self.window_days = window_days
+        self.window_end = None
+        self.last_movement_id = 0
+        self.moments = pd.DataFrame({"qty": [], "qty2": []})
+        self.lock = threading.Lock()
+
+    def refresh(self, today=None):
+        # Per-product sum and sum of squares of daily sales over the window. Read
+        # from the rollup once per day; later refreshes fold in new sale movements.
+        today = today or date.today()
+        start = (today - timedelta(days=self.window_days)).isoformat()
+        end = today.isoformat()
+        with self.lock, get_conn() as conn:
+            conn.execute("BEGIN")
+            try:
+                last_id = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM stock_movements"
+                ).fetchone()[0]
+                if self.window_end == today and last_id == self.last_movement_id:
+                    return self.moments
+                if self.window_end != today:
+                    query, params = SQL_SALES_MOMENTS, (start, end)
+                else:
+                    query = SQL_SALES_MOMENTS_DELTA
+                    params = (self.last_movement_id, last_id, start, end)
+                with profiled("read", query, params) as stat:
+                    rows = pd.read_sql_query(query, conn, params=params)
+                    stat["rows"] = len(rows)
+            finally:
+                conn.rollback()
+            if query is SQL_SALES_MOMENTS:
+                moments = rows.set_index("product_id").astype(float)
+            else:
+                # (y)^2 - (y - q)^2 where y is the day total after the new sales q.
+                rows["qty2"] = rows["day_total"] ** 2 - (rows["day_total"] - rows["qty"]) ** 2
+                delta = rows.groupby("product_id")[["qty", "qty2"]].sum()
+                moments = self.moments.add(delta, fill_value=0.0)
+            self.moments, self.window_end, self.last_movement_id = moments, today, last_id
+            return moments
+
+    def recommend(self, lead_days=REORDER_LEAD_DAYS, review_days=REORDER_REVIEW_DAYS, z=1.65):
+        moments = self.refresh()
+        products = fetch_df("SELECT id, name, sku, stock FROM products")
+        stats = moments.reindex(products["id"].to_numpy(), fill_value=0.0)
+        stock = products["stock"].to_numpy(dtype=float)
+        # Days without sales count as zero demand, so moments are over the whole window.
+        velocity = stats["qty"].to_numpy() / self.window_days
+        std = np.sqrt(np.clip(stats["qty2"].to_numpy() / self.window_days - velocity**2, 0, None))
+        lead_demand = velocity * lead_days
+        lead_std = std * np.sqrt(lead_days)
+        safety = z * lead_std
+        reorder_point = lead_demand + safety
+        order_up_to = velocity * (lead_days + review_days) + safety
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days_cover = np.where(velocity > 0, stock / velocity, np.inf)
+            risk_score = np.where(
+                lead_std > 0,
+                (stock - lead_demand) / lead_std,
+                np.where(stock < lead_demand, -np.inf, np.inf),
+            )
+        needs_order = (velocity > 0) & (stock <= reorder_point)
+        result = pd.DataFrame(
+            {
+                "Sản phẩm": products["name"],
+                "SKU": products["sku"],
+                "Tồn kho": products["stock"],
+                "Bán/ngày": velocity.round(2),
+                "Độ lệch/ngày": std.round(2),
+                "Số ngày đủ bán": days_cover.round(1),
+                "Điểm đặt hàng": np.ceil(reorder_point),
+                "Đề xuất nhập": np.ceil(np.clip(order_up_to - stock, 0, None)),
+                "Rủi ro": np.select(
+                    [stock <= 0, stock < lead_demand, stock < reorder_point],
+                    ["Hết hàng", "Cao", "Trung bình"],
+                    "Thấp",
+                ),
+                "risk_score": risk_score,
+            }
+        )[needs_order]
+        return (
+            result.sort_values(["risk_score", "Số ngày đủ bán"])
+            .drop(columns="risk_score")
+            .reset_index(drop=True)
+        )
+
+
+@resource
+def get_reorder_engine(path):
+    return ReorderEngine(path)
+
+
+CUSTOMER_SEGMENTS = (
+    "VIP",
+    "Trung thành",
+    "Khách mới",
+    "Có nguy cơ rời bỏ",
+    "Đã lâu không mua",
+    "Tiềm năng",
+)
+
+SCORE_COLUMNS = ["r_score", "f_score", "m_score", "rfm_score", "segment"]
+
+
+def quintile_scores(values):
+    # 1-5 by percentile rank. Ties take the lower score, so the many one-off buyers share F=1.
+    ranks = pd.Series(values).rank(method="min", pct=True).to_numpy()
+    return np.ceil(ranks * 5).astype(np.int64)
+
+
+def score_customers(stats):
+    orders = stats["orders"].to_numpy(dtype=np.int64)
+    last_order = np.asarray(stats["last_order"].to_numpy(dtype=object), dtype="datetime64[D]")
+    r = quintile_scores(last_order)
+    f = quintile_scores(orders)
+    m = quintile_scores(stats["revenue"].to_numpy(dtype=float))
+    segment = np.select(
+        [
+            (r >= 4) & (f >= 4) & (m >= 4),
+            (r >= 3) & (f >= 4),
+            (r >= 4) & (orders == 1),
+            (r <= 2) & (f >= 3),
+            r <= 2,
+        ],
+        list(CUSTOMER_SEGMENTS[:-1]),
+        CUSTOMER_SEGMENTS[-1],
+    )
+    return pd.DataFrame(
+        {"r_score": r, "f_score": f, "m_score": m, "rfm_score": r + f + m, "segment": segment},
+        index=stats.index,
+    )
+
+
+def refresh_customer_stats_tx(conn, rows, since, last_id, refreshed_at):
+    row = conn.execute("SELECT last_order_id FROM customer_stats_state").fetchone()
+    if (row[0] if row else 0) != since:
+        return None
+    conn.executemany(SQL_UPSERT_CUSTOMER_STATS, rows)
+    # Quintile boundaries move for everyone, but only rows whose scores change are rewritten.
+    stats = read_frame(
+        conn,
+        "SELECT customer_id, orders, revenue, last_order, "
+        + ", ".join(SCORE_COLUMNS)
+        + " FROM customer_stats",
+    )
+    scores = score_customers(stats)
+    changed = np.zeros(len(stats), dtype=bool)
+    for column in SCORE_COLUMNS:
+        changed |= scores[column].to_numpy() != stats[column].to_numpy()
+    conn.executemany(
+        SQL_UPDATE_CUSTOMER_SCORES,
+        zip(
+            *(scores[column].to_numpy()[changed].tolist() for column in SCORE_COLUMNS),
+            stats["customer_id"].to_numpy()[changed].tolist(),
+        ),
+    )
+    orders = stats["orders"].to_numpy(dtype=np.int64)
+    conn.execute(
+        "INSERT OR REPLACE INTO customer_stats_state VALUES (1, ?, ?, ?, ?, ?)",
+        (
+            last_id,
+            len(stats),
+            int((orders >= 2).sum()),
+            float(stats["revenue"].to_numpy(dtype=float).sum()),
+            refreshed_at,
+        ),
+    )
+    return int(changed.sum())
+
+
+def refresh_customer_stats():
+    # Batch job: fold orders placed since the last run into customer_stats, then rescore.
+    start = time.perf_counter()
+    with profiled("write", "-- refresh_customer_stats") as stat:
+        with get_conn() as conn:
+            ensure_archives(conn)
+            conn.execute("BEGIN")
+            try:
+                state = conn.execute("SELECT last_order_id FROM customer_stats_state").fetchone()
+                since = state[0] if state else 0
+                prefixes = archive_prefixes()
+                last_id = max(
+                    conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {prefix}orders").fetchone()[0]
+                    for prefix in prefixes
+                )
+                rows = [
+                    tuple(row)
+                    for prefix in prefixes
+                    for row in conn.execute(
+                        SQL_CUSTOMER_ORDERS_DELTA.format(db=prefix), (since, last_id, WALKIN_NAME)
+                    )
+                ]
+            finally:
+                conn.rollback()
+        rescored = None
+        if last_id > since or state is None:
+            refreshed_at = datetime.now().isoformat(timespec="seconds")
+            rescored = run_write(refresh_customer_stats_tx, rows, since, last_id, refreshed_at)
+        stat["rows"] = len(rows)
+    if rescored is not None:
+        invalidate_tables({"customer_stats", "customer_stats_state"})
+    return {
+        "orders": sum(row[1] for row in rows),
+        "customers": len({row[0] for row in rows}),
+        "rescored": rescored or 0,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def fetch_customer_summary():
+    df = fetch_df("SELECT * FROM customer_stats_state")
+    if df.empty:
+        return None
+    summary = df.iloc[0].to_dict()
+    summary["pending"] = int(
+        fetch_df(
+            "SELECT COUNT(*) AS pending FROM orders WHERE id > ? "
+            "AND customer_id NOT IN (SELECT id FROM customers WHERE name = ?)",
+            (int(summary["last_order_id"]), WALKIN_NAME),
+        )["pending"].iloc[0]
+    )
+    return summary
+
+
+def search_customer_stats(segment=None, after_id=None, page_size=PAGE_SIZE):
+    filters, params = [], [date.today().isoformat()]
+    if segment:
+        filters.append("s.segment = ?")
+        params.append(segment)
+    return fetch_keyset_page(
+        SQL_CUSTOMER_STATS,
+        filters,
+        params,
+        after_id,
+        page_size,
+        id_column="s.customer_id",
+        sort_columns=("s.rfm_score", "s.revenue"),
+    )
+
+
+def add_product_tx(conn, name, sku, price, stock, created_at):
+    cur = conn.execute(
+        "INSERT INTO products (name, sku, price, stock, created_at) VALUES (?, ?, ?, 0, ?)",
+        (name, sku, price, created_at),
+    )
+    if stock:
+        conn.execute(
+            SQL_INSERT_MOVEMENT,
+            movement_row(cur.lastrowid, created_at, stock, "import", note="Tạo sản phẩm"),
+        )
+    return cur.lastrowid
+
+
+def add_product(name, sku, price, stock):
+    today = date.today().isoformat()
+    with profiled("write", "-- add_product", (name, sku)) as stat:
+        product_id = run_write(add_product_tx, name, sku, price, int(stock), today)
+        stat["rows"] = 1
+    invalidate_tables({"products", "stock_movements"})
+    return product_id
+
+
+def adjust_stock_tx(conn, product_id, qty, kind, note, day):
+    conn.execute(SQL_INSERT_MOVEMENT, movement_row(product_id, day, qty, kind, note=note))
+    check_stock(conn, [int(product_id)])
+
+
+def adjust_stock(product_id, qty, kind, note=None, day=None):
+    day = day or date.today().isoformat()
+    with profiled("write", "-- adjust_stock", (product_id, qty, kind)) as stat:
+        run_write(adjust_stock_tx, product_id, qty, kind, note, day)
+        stat["rows"] = 1
+    invalidate_tables({"stock_movements"})
+
+
+def ensure_stock_snapshot():
+    # Weekly end-of-day snapshots keep the as-of delta scan to a few days of movements.
+    latest = fetch_df("SELECT MAX(day) AS day FROM stock_snapshots")["day"].iloc[0]
+    if pd.notna(latest) and latest >= date.today() - timedelta(days=STOCK_SNAPSHOT_DAYS):
+        return None
+    day = (date.today() - timedelta(days=1)).isoformat()
+    with profiled("write", "-- take_stock_snapshot", (day,)):
+        run_write(take_stock_snapshot, day)
+    invalidate_tables({"stock_snapshots"})
+    return day
+
+
+def stock_is_current(day):
+    # products.stock already holds the balance after the last movement.
+    latest = fetch_df("SELECT MAX(day) AS day FROM stock_movements")["day"].iloc[0]
+    return pd.isna(latest) or date.fromisoformat(day) >= latest
+
+
+def fetch_inventory(day):
+    if stock_is_current(day):
+        return fetch_df(SQL_INVENTORY)
+    return fetch_df(SQL_INVENTORY_AS_OF, (day,))
+
+
+def fetch_low_stock(threshold, day):
+    if stock_is_current(day):
+        return fetch_df(SQL_LOW_STOCK, (threshold,))
+    return fetch_df(SQL_LOW_STOCK_AS_OF, (day, threshold))
+
+
+def like_pattern(text, prefix=False):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%" if prefix else f"%{escaped}%"
+
+
+def fetch_keyset_page(
+    query,
+    filters,
+    params,
+    after_id=None,
+    page_size=PAGE_SIZE,
+    id_column="id",
+    sort_columns=(),
+):
+    # With sort_columns the cursor is a tuple of (*sort_columns, id), compared as a row value.
+    key = [*sort_columns, id_column]
+    clauses = list(filters)
+    args = list(params)
+    if after_id is not None and sort_columns:
+        clauses.append(f"({', '.join(key)}) < ({', '.join('?' * len(key))})")
+        args.extend(after_id)
+    elif after_id is not None:
+        clauses.append(f"{id_column} < ?")
+        args.append(int(after_id))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # One extra row tells us whether a next page exists without a COUNT(*).
+    order = ", ".join(f"{column} DESC" for column in key)
+    sql = f"{query} {where} ORDER BY {order} LIMIT ?"
+    args.append(int(page_size) + 1)
+    if "{db}" in query:
+        # Each year file pages on its own key; the newest rows across files win.
+        frames = [fetch_df(sql.format(db=prefix), args) for prefix in archive_prefixes()]
+        frames = [frame for frame in frames if not frame.empty] or frames[-1:]
+        df = pd.concat(frames, ignore_index=True)
+        columns = [column.rsplit(".", 1)[-1] for column in key]
+        df = df.sort_values(columns, ascending=False, ignore_index=True).head(page_size + 1)
+    else:
+        df = fetch_df(sql, args)
+    return df.head(page_size), len(df) > page_size
+
+
+def search_products(name=None, sku=None, after_id=None, page_size=PAGE_SIZE):
+    filters, params = [], []
+    if name:
+        filters.append("name LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(name))
+    if sku:
+        filters.append("sku LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(sku, prefix=True))
+    return fetch_keyset_page(
+        "SELECT id, name, sku, price, stock, created_at FROM products",
+        filters,
+        params,
+        after_id,
+        page_size,
+    )
+
+
+def search_customers(name=None, phone=None, after_id=None, page_size=PAGE_SIZE):
+    filters, params = ["name != ?"], [WALKIN_NAME]
+    if normalize_text(name):
+        filters.append("name_key LIKE ?")
+        params.append(like_pattern(normalize_text(name)))
+    if normalize_phone(phone):
+        filters.append("phone_key LIKE ?")
+        params.append(like_pattern(normalize_phone(phone), prefix=True))
+    return fetch_keyset_page(
+        "SELECT id, name, phone, email, address, created_at FROM customers",
+        filters,
+        params,
+        after_id,
+        page_size,
+    )
+
+
+def search_orders(
+    customer=None,
+    status=None,
+    date_from=None,
+    date_to=None,
+    archived=False,
+    after_id=None,
+    page_size=PAGE_SIZE,
+):
+    filters, params = [], []
+    if customer:
+        filters.append("c.name LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(customer))
+    if status:
+        filters.append("o.status = ?")
+        params.append(status)
+    if date_from:
+        filters.append("o.order_date >= ?")
+        params.append(date_from)
+    if date_to:
+        filters.append("o.order_date <= ?")
+        params.append(date_to)
+    return fetch_keyset_page(
+        f"""
+        SELECT o.id, o.order_date, o.status, o.total, c.name AS customer
+        FROM {"{db}orders" if archived else "orders"} o
+        JOIN customers c ON o.customer_id = c.id
+        """,
+        filters,
+        params,
+        after_id,
+        page_size,
+        id_column="o.id",
+    )
+
+
+def list_order_statuses():
+    return fetch_df("SELECT DISTINCT status FROM orders ORDER BY status")["status"].tolist()
+
+
+def lookup_products(term, limit=PRODUCT_LOOKUP_LIMIT):
+    term = term.strip()
+    if not term:
+        return fetch_df(
+            "SELECT id, name, sku, price, stock FROM products ORDER BY id DESC LIMIT ?",
+            (limit,),
+        )
+    # A scanned barcode is an exact SKU: one probe of the UNIQUE index.
+    exact = fetch_df(SQL_PRODUCT_BY_SKU, (term,))
+    if not exact.empty:
+        return exact
+    if len(term) >= 3:
+        phrase = '"' + term.replace('"', '""') + '"'
+        return fetch_df(SQL_PRODUCT_FTS, (phrase, limit))
+    # Trigrams need at least three characters; short terms fall back to a prefix match.
+    return fetch_df(
+        "SELECT id, name, sku, price, stock FROM products WHERE name LIKE ? ESCAPE '\\' LIMIT ?",
+        (like_pattern(term, prefix=True), limit),
+    )
+
+
+def lookup_customers(term, limit=CUSTOMER_LOOKUP_LIMIT):
+    term = term.strip()
+    if not term:
+        return fetch_df(
+            "SELECT id, name, phone FROM customers WHERE name != ? ORDER BY id DESC LIMIT ?",
+            (WALKIN_NAME, limit),
+        )
+    if re.search(r"[^\d\s+().-]", term):
+        query, key = SQL_CUSTOMER_BY_NAME, normalize_text(term)
+    else:
+        query, key = SQL_CUSTOMER_BY_PHONE, normalize_phone(term)
+    if not key:
+        # Punctuation alone leaves no key to search on.
+        return pd.DataFrame(columns=["id", "name", "phone"])
+    # Keys only hold [0-9a-z ], so a trailing * is a plain, index-driven prefix GLOB.
+    return fetch_df(query, (f"{key}*", WALKIN_NAME, limit))
+
+
+def has_products():
+    return not fetch_df("SELECT id FROM products LIMIT 1").empty
+
+
+# Imported chunks are staged here so each chunk is applied with a few set-based statements.
+SQL_IMPORT_PRODUCTS_TABLE = """
+CREATE TEMP TABLE IF NOT EXISTS import_products (
+    product_id INTEGER,
+    name TEXT NOT NULL,
+    sku TEXT UNIQUE,
+    price REAL,
+    stock INTEGER,
+    created_at TEXT NOT NULL
+)
+"""
+
+# A row without a price keeps the catalog price; excluded.price is already 0 by
+# then, so the staged value is looked up again by SKU.
+SQL_UPSERT_PRODUCTS = """
+INSERT INTO products (id, name, sku, price, stock, created_at)
+SELECT product_id, name, sku, COALESCE(price, 0), 0, created_at
+FROM temp.import_products WHERE true
+ON CONFLICT(sku) DO UPDATE SET
+    name = excluded.name,
+    price = COALESCE(
+        (SELECT i.price FROM temp.import_products i WHERE i.sku = excluded.sku), price
+    )
+"""
+
+# The sheet's stock is a count: book the difference as an import movement.
+SQL_IMPORT_MOVEMENTS = """
+INSERT INTO stock_movements (product_id, day, qty, kind, order_id, note, created_at)
+SELECT p.id, i.created_at, i.stock - p.stock, 'import', NULL, 'Nhập Excel', ?
+FROM temp.import_products i
+JOIN products p ON p.id = i.product_id
+WHERE i.stock IS NOT NULL AND i.stock != p.stock
+"""
+
+SQL_UPDATE_IMPORTED_CUSTOMER = """
+UPDATE customers SET
+    name = ?,
+    phone = COALESCE(?, phone),
+    email = COALESCE(?, email),
+    address = COALESCE(?, address),
+    name_key = ?,
+    phone_key = COALESCE(?, phone_key)
+WHERE id = ?
+"""
+
+
+def excel_sheet_names(file):
+    file.seek(0)
+    workbook = load_workbook(file, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def count_excel_rows(file, sheet=None):
+    file.seek(0)
+    workbook = load_workbook(file, read_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        # Files written in streaming mode may not record their dimensions.
+        return (worksheet.max_row or 0) - 1 if (worksheet.max_row or 0) > 1 else None
+    finally:
+        workbook.close()
+
+
+def iter_excel_chunks(file, sheet=None, chunk_size=IMPORT_CHUNK_SIZE):
+    file.seek(0)
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [
+            str(cell).strip() if cell is not None and str(cell).strip() else f"Cột {i + 1}"
+            for i, cell in enumerate(header)
+        ]
+        width = len(columns)
+        first_row = 2
+        while True:
+            chunk = [
+                tuple(row[:width]) + (None,) * (width - len(row))
+                for row in islice(rows, chunk_size)
+            ]
+            if not chunk:
+                return
+            frame = pd.DataFrame(chunk, columns=columns)
+            frame.index = pd.RangeIndex(first_row, first_row + len(chunk))
+            yield frame
+            first_row += len(chunk)
+    finally:
+        workbook.close()
+
+
+def clean_text(series):
+    # Excel hands numeric SKUs and phone numbers back as floats; drop the ".0".
+    text = series.astype("string").str.strip()
+    text = text.str.replace(r"^(-?\d+)\.0$", r"\1", regex=True)
+    return text.mask(text == "")
+
+
+def to_number(text):
+    return pd.to_numeric(text.str.replace(r"[\s,]", "", regex=True), errors="coerce")
+
+
+def first_failure(checks, index):
+    reason = pd.Series(pd.NA, index=index, dtype="string")
+    for mask, message in reversed(checks):
+        reason = reason.mask(mask.fillna(False), message)
+    return reason
+
+
+def optional_column(cleaned, column):
+    if column:
+        return cleaned[column]
+    return pd.Series(pd.NA, index=cleaned.index, dtype="string")
+
+
+def prepare_products(cleaned, columns):
+    name = cleaned[columns["name"]]
+    sku = optional_column(cleaned, columns.get("sku"))
+    price_text = optional_column(cleaned, columns.get("price"))
+    stock_text = optional_column(cleaned, columns.get("stock"))
+    price = to_number(price_text)
+    stock = to_number(stock_text)
+    reason = first_failure(
+        [
+            (name.isna(), "Thiếu tên sản phẩm"),
+            ((price_text.notna() & price.isna()) | (price < 0), "Giá không hợp lệ"),
+            (
+                (stock_text.notna() & stock.isna()) | (stock < 0) | (stock % 1 != 0),
+                "Tồn kho không hợp lệ",
+            ),
+        ],
+        cleaned.index,
+    )
+    good = reason.isna()
+    rows = pd.DataFrame(
+        {
+            "name": name[good],
+            "sku": sku[good],
+            "price": price[good].astype(float),
+            "stock": stock[good].astype("Int64"),
+            "created_at": date.today().isoformat(),
+        }
+    )
+    return rows, reason
+
+
+def prepare_customers(cleaned, columns):
+    name = cleaned[columns["name"]]
+    phone = optional_column(cleaned, columns.get("phone"))
+    email = optional_column(cleaned, columns.get("email"))
+    phone_key = normalize_phone_series(phone)
+    email_key = email.str.lower()
+    reason = first_failure(
+        [
+            (name.isna(), "Thiếu họ tên"),
+            (email.notna() & ~email.str.contains("@", regex=False), "Email không hợp lệ"),
+        ],
+        cleaned.index,
+    )
+    # A customer repeated in the file is imported once, from its last row; the
+    # earlier rows are reported with the row that replaced them.
+    for key, label in ((phone_key, "SĐT"), (email_key, "email")):
+        candidates = reason.isna() & key.notna()
+        kept = pd.Series(key.index, index=key.index)[candidates].groupby(key[candidates])
+        kept_row = kept.transform("last")
+        repeated = kept_row[kept_row != kept_row.index]
+        reason[repeated.index] = f"Trùng {label} với dòng " + repeated.astype(str)
+    good = reason.isna()
+    rows = pd.DataFrame(
+        {
+            "name": name[good],
+            "phone": phone[good],
+            "email": email[good],
+            "address": optional_column(cleaned, columns.get("address"))[good],
+            "created_at": date.today().isoformat(),
+            "name_key": normalize_text_series(name[good]),
+            "phone_key": phone_key[good],
+            "email_key": email_key[good],
+        }
+    )
+    return rows, reason
+
+
+def to_records(df, columns):
+    # Plain Python values with None for missing, as sqlite3 expects.
+    values = df[columns].astype(object)
+    return list(values.where(values.notna(), None).itertuples(index=False, name=None))
+
+
+def upsert_products(conn, rows):
+    # A SKU repeated in the chunk ends up as its last row; its last given price
+    # and stock count win.
+    with_sku = rows[rows["sku"].notna()]
+    last = with_sku.drop_duplicates("sku", keep="last").set_index("sku")
+    for column in ("price", "stock"):
+        last[column] = with_sku.dropna(subset=[column]).groupby("sku")[column].last()
+    staged = pd.concat([rows[rows["sku"].isna()], last.reset_index()], ignore_index=True)
+    # New products without a SKU cannot be matched back by key, so they get their
+    # ids up front, after the highest id AUTOINCREMENT has handed out. They are
+    # staged first, so AUTOINCREMENT numbers the new SKUs after them.
+    top = conn.execute(
+        "SELECT MAX(COALESCE(MAX(id), 0), "
+        "COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'products'), 0)) FROM products"
+    ).fetchone()[0]
+    no_sku = staged["sku"].isna()
+    staged["product_id"] = pd.Series(pd.NA, index=staged.index, dtype="Int64")
+    staged.loc[no_sku, "product_id"] = range(top + 1, top + 1 + int(no_sku.sum()))
+
+    conn.execute(SQL_IMPORT_PRODUCTS_TABLE)
+    conn.execute("DELETE FROM temp.import_products")
+    conn.executemany(
+        "INSERT INTO temp.import_products VALUES (?, ?, ?, ?, ?, ?)",
+        to_records(staged, ["product_id", "name", "sku", "price", "stock", "created_at"]),
+    )
+    conn.execute(SQL_UPSERT_PRODUCTS)
+    conn.execute(
+        "UPDATE temp.import_products SET product_id = "
+        "(SELECT id FROM products WHERE sku = import_products.sku) WHERE sku IS NOT NULL"
+    )
+    conn.execute(SQL_IMPORT_MOVEMENTS, (datetime.now().isoformat(timespec="seconds"),))
+    conn.execute("DELETE FROM temp.import_products")
+    return len(rows)
+
+
+def match_existing(conn, column_sql, keys):
+    if keys.empty:
+        return {}
+    found = conn.execute(
+        f"SELECT id, {column_sql} AS k FROM customers "
+        f"WHERE {column_sql} IN (SELECT value FROM json_each(?))",
+        (json.dumps(keys.dropna().unique().tolist()),),
+    ).fetchall()
+    return {row["k"]: row["id"] for row in found}
+
+
+def upsert_customers(conn, rows):
+    by_phone = match_existing(conn, "phone_key", rows["phone_key"])
+    by_email = match_existing(conn, "lower(email)", rows["email_key"])
+    existing_id = rows["phone_key"].map(by_phone)
+    existing_id = existing_id.fillna(rows["email_key"].map(by_email))
+
+    updates = rows[existing_id.notna()].assign(id=existing_id.dropna().astype(int))
+    inserts = rows[existing_id.isna()]
+    conn.executemany(
+        SQL_UPDATE_IMPORTED_CUSTOMER,
+        to_records(updates, ["name", "phone", "email", "address", "name_key", "phone_key", "id"]),
+    )
+    conn.executemany(
+        SQL_INSERT_CUSTOMER,
+        to_records(
+            inserts,
+            ["name", "phone", "email", "address", "created_at", "name_key", "phone_key"],
+        ),
+    )
+    return len(rows)
+
+
+def run_excel_import(
+    file, columns, prepare, apply, tables, sheet=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None
+):
+    total = count_excel_rows(file, sheet)
+    processed = imported = 0
+    rejects = []
+    try:
+        for chunk in iter_excel_chunks(file, sheet, chunk_size):
+            cleaned = chunk.apply(clean_text)
+            filled = cleaned.notna().any(axis=1)
+            rows, reason = prepare(cleaned[filled], columns)
+            if reason.notna().any():
+                rejected = cleaned.loc[reason.index[reason.notna()]].copy()
+                rejected.insert(0, "Lý do", reason[reason.notna()])
+                rejected.insert(0, "Dòng", rejected.index)
+                rejects.append(rejected)
+            if not rows.empty:
+                with profiled("write", f"-- {apply.__name__}", None) as stat:
+                    stat["rows"] = run_write(apply, rows)
+                imported += stat["rows"]
+            processed += len(chunk)
+            if progress:
+                progress(processed, total)
+    finally:
+        if imported:
+            invalidate_tables(tables)
+    return {
+        "processed": processed,
+        "imported": imported,
+        "rejects": pd.concat(rejects) if rejects else pd.DataFrame(),
+    }
+
+
+def import_products(file, columns, **kwargs):
+    return run_excel_import(
+        file, columns, prepare_products, upsert_products, {"products"}, **kwargs
+    )
+
+
+def import_customers(file, columns, **kwargs):
+    return run_excel_import(
+        file, columns, prepare_customers, upsert_customers, {"customers"}, **kwargs
+    )
+
+
+# name -> (label, query, date parameters: a "period" range or an as-of "day")
+EXPORT_DATASETS = {
+    "orders": ("Đơn hàng kèm chi tiết", SQL_EXPORT_ORDER_LINES, "period"),
+    "inventory": ("Tồn kho", SQL_INVENTORY_AS_OF, "day"),
+    "revenue": ("Doanh thu theo ngày", SQL_REVENUE_BY_DAY, "period"),
+    "product-sales": ("Doanh số theo sản phẩm", SQL_PRODUCT_SALES, "period"),
+}
+
+
+def iter_query_chunks(query, params=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Always yields at least one (possibly empty) frame so writers get the header.
+    with profiled("export", query, params) as stat, get_conn() as conn:
+        queries = [query]
+        if "{db}" in query:
+            ensure_archives(conn)
+            queries = [query.format(db=prefix) for prefix in archive_prefixes()]
+        elif reads_archives(read_tables(query)):
+            ensure_archives(conn)
+        for sql in queries:
+            cur = conn.execute(sql, params or [])
+            columns = [column[0] for column in cur.description]
+            while rows := cur.fetchmany(chunk_size):
+                stat["rows"] += len(rows)
+                yield pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+        if not stat["rows"]:
+            yield pd.DataFrame(columns=columns)
+
+
+def write_csv(chunks, out):
+    out.write(codecs.BOM_UTF8)
+    count = 0
+    for index, chunk in enumerate(chunks):
+        out.write(chunk.to_csv(index=False, header=index == 0).encode())
+        count += len(chunk)
+    return count
+
+
+def write_xlsx(chunks, out, title="Dữ liệu"):
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, count = None, 0, 0
+    for chunk in chunks:
+        values = chunk.astype(object).where(chunk.notna(), None)
+        if sheet is None:
+            sheet = workbook.create_sheet(title)
+            sheet.append(list(chunk.columns))
+            sheet_rows = 1
+        for row in values.itertuples(index=False):
+            if sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"{title} {len(workbook.worksheets) + 1}")
+                sheet.append(list(chunk.columns))
+                sheet_rows = 1
+            sheet.append(list(row))
+            sheet_rows += 1
+        count += len(chunk)
+    workbook.save(out)
+    return count
+
+
+def write_parquet(chunks, out):
+    writer, count = None, 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                # A column that is all NULL in the first chunk has no type yet.
+                schema = pa.schema(
+                    field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                    for field in table.schema
+                ).remove_metadata()
+                writer = pq.ParquetWriter(out, schema)
+            writer.write_table(table.cast(schema))
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# format -> (writer, file extension, MIME type)
+EXPORT_FORMATS = {
+    "csv": (write_csv, "csv", "text/csv"),
+    "xlsx": (
+        write_xlsx,
+        "xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ),
+    "parquet": (write_parquet, "parquet", "application/vnd.apache.parquet"),
+}
+
+
+def export_dataset(name, fmt, out, date_from=None, date_to=None, chunk_size=EXPORT_CHUNK_SIZE):
+    _, query, dated = EXPORT_DATASETS[name]
+    if dated == "period":
+        params = (date_from or "0000-01-01", date_to or "9999-12-31")
+    else:
+        params = (date_to or date.today().isoformat(),)
+    writer = EXPORT_FORMATS[fmt][0]
+    return writer(iter_query_chunks(query, params, chunk_size), out)
+
+
+def export_file_name(name, fmt, date_from=None, date_to=None):
+    parts = [name] + [value for value in (date_from, date_to) if value]
+    return "_".join(parts) + "." + EXPORT_FORMATS[fmt][1]
+
+
+def list_invoice_ids(date_from=None, date_to=None):
+    params = (date_from or "0000-01-01", date_to or "9999-12-31")
+    with profiled("read", SQL_INVOICE_IDS, params) as stat, get_conn() as conn:
+        ensure_archives(conn)
+        order_ids = [row[0] for row in conn.execute(SQL_INVOICE_IDS, params)]
+        stat["rows"] = len(order_ids)
+    return order_ids
+
+
+def fetch_invoices(order_ids):
+    ids = json.dumps([int(order_id) for order_id in order_ids])
+    with profiled("read", "-- fetch_invoices", (len(order_ids),)) as stat, get_conn() as conn:
+        ensure_archives(conn)
+        invoices = {
+            row["id"]: dict(row, items=[]) for row in conn.execute(SQL_INVOICE_HEADERS, (ids,))
+        }
+        for row in conn.execute(SQL_INVOICE_LINES, (ids,)):
+            invoices[row["order_id"]]["items"].append(dict(row))
+            stat["rows"] += 1
+    # An outer ORDER BY would stop SQLite from pushing the id list into each year file.
+    for invoice in invoices.values():
+        invoice["items"].sort(key=lambda item: item["id"])
+    return [invoices[int(order_id)] for order_id in order_ids if int(order_id) in invoices]
+
+
+def write_invoices(
+    order_ids,
+    output,
+    as_zip=False,
+    workers=INVOICE_WORKERS,
+    batch_size=INVOICE_BATCH_SIZE,
+    progress=None,
+):
+    if as_zip:
+        archive = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+        save = archive.writestr
+    else:
+        archive = None
+        os.makedirs(output, exist_ok=True)
+
+        def save(name, html):
+            with open(os.path.join(output, name), "w", encoding="utf-8") as handle:
+                handle.write(html)
+
+    written = 0
+
+    def collect(futures):
+        nonlocal written
+        for future in futures:
+            for name, html in future.result():
+                save(name, html)
+                written += 1
+        if progress:
+            progress(written, len(order_ids))
+
+    # Headers and items are fetched per batch in this process; workers only render.
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for start in range(0, len(order_ids), batch_size):
+                invoices = fetch_invoices(order_ids[start:start + batch_size])
+                pending.add(pool.submit(render_invoice_batch, invoices))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(pending)
+    finally:
+        if archive is not None:
+            archive.close()
+    return written
+
+
+def archive_order_batch(conn, name, start, end, keep_statuses, batch_size):
+    ids = json.dumps(
+        [
+            row[0]
+            for row in conn.execute(
+                """
+                SELECT id FROM main.orders
+                WHERE order_date >= ? AND order_date < ?
+                  AND status NOT IN (SELECT value FROM json_each(?))
+                ORDER BY order_date
+                LIMIT ?
+                """,
+                (start, end, json.dumps(list(keep_statuses)), batch_size),
+            )
+        ]
+    )
+    if ids == "[]":
+        return 0
+    # Copies are INSERT OR REPLACE so a batch interrupted between the two files
+    # is simply redone by the next run.
+    conn.execute("INSERT INTO archiving (year) VALUES (?)", (int(start[:4]),))
+    conn.execute(
+        f"INSERT OR REPLACE INTO {name}.orders SELECT id, customer_id, order_date, status, total "
+        "FROM main.orders WHERE id IN (SELECT value FROM json_each(?))",
+        (ids,),
+    )
+    conn.execute(
+        f"INSERT OR REPLACE INTO {name}.order_items SELECT id, order_id, product_id, qty, price "
+        "FROM main.order_items WHERE order_id IN (SELECT value FROM json_each(?))",
+        (ids,),
+    )
+    conn.execute(
+        "DELETE FROM main.order_items WHERE order_id IN (SELECT value FROM json_each(?))", (ids,)
+    )
+    cur = conn.execute(
+        "DELETE FROM main.orders WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+    )
+    conn.execute("DELETE FROM archiving")
+    return cur.rowcount
+
+
+def archive_orders(cutoff, keep_statuses=(), batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    moved = {}
+    conn = open_connection(DB_PATH)
+    try:
+        years = [
+            int(row[0])
+            for row in conn.execute(
+                "SELECT DISTINCT substr(order_date, 1, 4) FROM orders WHERE order_date < ?",
+                (cutoff,),
+            )
+        ]
+        for year in years:
+            name = attach_archive(conn, year, create=True)
+            start, end = f"{year}-01-01", min(cutoff, f"{year + 1}-01-01")
+            moved[year] = 0
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    count = archive_order_batch(conn, name, start, end, keep_statuses, batch_size)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                if not count:
+                    break
+                moved[year] += count
+                if progress:
+                    progress(year, moved[year])
+            conn.execute(f"DETACH DATABASE {name}")
+    finally:
+        conn.close()
+    if moved:
+        invalidate_tables(None)
+    return moved
+
+
+def backup_folder():
+    return os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), BACKUP_DIR)
+
+
+def list_backups(folder=None):
+    folder = folder or backup_folder()
+    prefix = os.path.splitext(os.path.basename(DB_PATH))[0]
+    pattern = re.compile(re.escape(prefix) + r"-\d{8}-\d{6}(-\d+)*\.db(\.gz)?$")
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    # Names carry the timestamp, so sorting by name is sorting by age (newest last).
+    return [os.path.join(folder, name) for name in sorted(names) if pattern.match(name)]
+
+
+def backup_archives(backup):
+    # Per-year archive copies sit next to the main copy as <name>_<year>.db[.gz].
+    folder, name = os.path.split(backup)
+    stem = re.sub(r"\.db(\.gz)?$", "", name)
+    pattern = re.compile(re.escape(stem) + r"_(\d{4})\.db(\.gz)?$")
+    return {
+        int(match.group(1)): os.path.join(folder, match.group(0))
+        for match in map(pattern.match, sorted(os.listdir(folder or ".")))
+        if match
+    }
+
+
+def rotate_backups(folder=None, keep=BACKUP_KEEP):
+    removed = list_backups(folder)[:-keep] if keep > 0 else []
+    for path in removed:
+        for archive in backup_archives(path).values():
+            os.remove(archive)
+        os.remove(path)
+    return removed
+
+
+def check_integrity(conn):
+    problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    if problems != ["ok"]:
+        raise sqlite3.DatabaseError("integrity_check: " + "; ".join(problems[:5]))
+
+
+def backup_file(source, name, path, compress, pages, progress):
+    partial = path + ".part"
+    target = sqlite3.connect(partial)
+    try:
+        start = time.perf_counter()
+        source.backup(target, pages=pages, progress=progress, name=name)
+        copy_seconds = time.perf_counter() - start
+        target.execute("PRAGMA journal_mode = DELETE")
+        check_integrity(target)
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    target.close()
+    size = os.path.getsize(partial)
+    if compress:
+        with open(partial, "rb") as raw, gzip.open(path + ".gz", "wb", 6) as out:
+            shutil.copyfileobj(raw, out, 1024 * 1024)
+        os.remove(partial)
+        path += ".gz"
+    else:
+        os.replace(partial, path)
+    return path, size, page_count, copy_seconds
+
+
+def backup_database(folder=None, compress=False, keep=BACKUP_KEEP, pages=BACKUP_PAGES):
+    folder = folder or backup_folder()
+    os.makedirs(folder, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(DB_PATH))[0]
+    stem = base = os.path.join(folder, f"{prefix}-{datetime.now():%Y%m%d-%H%M%S-%f}")
+    # Two backups in the same instant must not replace each other.
+    counter = 0
+    while os.path.exists(stem + ".db") or os.path.exists(stem + ".db.gz"):
+        counter += 1
+        stem = f"{base}-{counter}"
+    steps = {"count": 0}
+
+    def progress(status, remaining, total):
+        steps["count"] += 1
+
+    result = {"pages": 0, "bytes": 0, "copy_seconds": 0.0, "files": []}
+    start = time.perf_counter()
+    with profiled("backup", "-- backup_database", (os.path.basename(stem),)) as stat:
+        source = open_connection(DB_PATH)
+        try:
+            years = archive_years()
+            for year in years:
+                attach_archive(source, year)
+            # One read transaction pins a WAL snapshot of every file, so writers carry
+            # on between page steps without restarting the copy. The main file is
+            # pinned first: a batch the archive job moves meanwhile can only appear
+            # in both copies (a rerun of the job settles it), never in neither.
+            source.execute("BEGIN")
+            for name in ["main"] + [f"archive_{year}" for year in years]:
+                source.execute(f"SELECT 1 FROM {name}.sqlite_master LIMIT 1").fetchone()
+            targets = [("main", stem + ".db")]
+            targets += [(f"archive_{year}", f"{stem}_{year}.db") for year in years]
+            for name, path in targets:
+                path, size, page_count, copy_seconds = backup_file(
+                    source, name, path, compress, pages, progress
+                )
+                result["files"].append(path)
+                result["bytes"] += size
+                result["pages"] += page_count
+                result["copy_seconds"] += copy_seconds
+            source.rollback()
+        except BaseException:
+            for path in result["files"]:
+                os.remove(path)
+            raise
+        finally:
+            source.close()
+        stat["rows"] = result["pages"]
+    result["path"] = result["files"][0]
+    result["stored_bytes"] = sum(os.path.getsize(path) for path in result["files"])
+    result["steps"] = steps["count"]
+    result["seconds"] = time.perf_counter() - start
+    result["pages_per_sec"] = result["pages"] / max(result["copy_seconds"], 1e-9)
+    result["removed"] = rotate_backups(folder, keep)
+    return result
+
+
+def restore_file(backup, partial):
+    if backup.endswith(".gz"):
+        with gzip.open(backup, "rb") as raw, open(partial, "wb") as out:
+            shutil.copyfileobj(raw, out, 1024 * 1024)
+    else:
+        source = sqlite3.connect(f"file:{backup}?mode=ro", uri=True)
+        copy = sqlite3.connect(partial)
+        try:
+            source.backup(copy)
+        finally:
+            copy.close()
+            source.close()
+    conn = sqlite3.connect(partial)
+    try:
+        check_integrity(conn)
+        return get_schema_version(conn)
+    finally:
+        conn.close()
+
+
+def restore_backup(backup, target):
+    # Always into new files: the live database is swapped by the operator, not here.
+    # Archive copies land where archive_path() expects them next to the target.
+    base, ext = os.path.splitext(target)
+    targets = {backup: target}
+    for year, archive in backup_archives(backup).items():
+        targets[archive] = f"{base}_{year}{ext or '.db'}"
+    for path in targets.values():
+        if os.path.exists(path):
+            raise FileExistsError(path)
+    start = time.perf_counter()
+    try:
+        versions = {source: restore_file(source, path + ".part") for source, path in targets.items()}
+    except BaseException:
+        for path in targets.values():
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+        raise
+    for path in targets.values():
+        os.replace(path + ".part", path)
+    return {
+        "path": target,
+        "archives": list(targets.values())[1:],
+        "version": versions[backup],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+class BackupScheduler:
+    def __init__(self, interval_hours, compress=True, keep=BACKUP_KEEP):
+        self.interval = interval_hours * 3600
+        self.compress = compress
+        self.keep = keep
+        self.last = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="sqlite-backup", daemon=True)
+        self._thread.start()
+
+    def due_in(self):
+        backups = list_backups()
+        if not backups:
+            return 0
+        return max(0, os.path.getmtime(backups[-1]) + self.interval - time.time())
+
+    def _run(self):
+        while True:
+            time.sleep(self.due_in())
+            try:
+                self.last = backup_database(compress=self.compress, keep=self.keep)
+                self.error = None
+            except Exception as exc:
+                self.error = f"{type(exc).__name__}: {exc}"
+                time.sleep(min(self.interval, 600))
+
+
+@resource
+def get_backup_scheduler(path):
+    return BackupScheduler(BACKUP_INTERVAL_HOURS) if BACKUP_INTERVAL_HOURS > 0 else None
+
+
+class SkuMap:
+    # SKU -> product id, shared by every ingestion batch. Entries are only a hint:
+    # ids are checked again inside the batch transaction.
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, conn, skus):
+        with self._lock:
+            missing = [sku for sku in skus if sku not in self._ids]
+        if missing:
+            rows = conn.execute(
+                "SELECT sku, id FROM products WHERE sku IN (SELECT value FROM json_each(?))",
+                (json.dumps(missing),),
+            ).fetchall()
+            with self._lock:
+                self._ids.update((row["sku"], row["id"]) for row in rows)
+        with self._lock:
+            return {sku: self._ids.get(sku) for sku in skus}
+
+    def forget(self, skus):
+        with self._lock:
+            for sku in skus:
+                self._ids.pop(sku, None)
+
+
+@resource
+def get_sku_map(path):
+    return SkuMap()
+
+
+def order_shape_error(order):
+    if not isinstance(order, dict):
+        return "mỗi dòng phải là một đơn hàng"
+    if not isinstance(order.get("client_order_id"), (str, int)):
+        return "thiếu client_order_id"
+    for field in ("order_date", "customer_phone", "customer_name", "status"):
+        if order.get(field) is not None and not isinstance(order[field], str):
+            return f"{field} phải là chuỗi"
+    items = order.get("items")
+    if not isinstance(items, list) or not items:
+        return "items phải là danh sách sản phẩm"
+    if not all(isinstance(item, dict) for item in items):
+        return "mỗi sản phẩm trong items phải là một đối tượng"
+    return None
+
+
+def parse_order_line(line):
+    # Shape problems are recorded on the order itself, so one bad line is
+    # rejected on its own instead of failing the whole batch.
+    try:
+        order = json.loads(line)
+    except json.JSONDecodeError as exc:
+        return {"error": f"JSON không hợp lệ: {exc}"}
+    error = order_shape_error(order)
+    if error is None:
+        return order
+    client_id = order.get("client_order_id") if isinstance(order, dict) else None
+    if not isinstance(client_id, (str, int)):
+        client_id = None
+    return {"client_order_id": client_id, "error": error}
+
+
+def product_prices(conn, product_ids):
+    rows = conn.execute(
+        "SELECT id, price FROM products WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(product_ids)),),
+    )
+    return {row["id"]: row["price"] for row in rows}
+
+
+def ingest_customer_id(conn, order, walkin_id):
+    phone = normalize_phone(order.get("customer_phone"))
+    if not phone:
+        return walkin_id
+    row = conn.execute(
+        "SELECT id FROM customers WHERE phone_key = ? AND name != ? LIMIT 1", (phone, WALKIN_NAME)
+    ).fetchone()
+    if row:
+        return row["id"]
+    name = str(order.get("customer_name") or "").strip() or phone
+    return conn.execute(SQL_INSERT_CUSTOMER, customer_row(name, phone, None, None)).lastrowid
+
+
+def ingest_order_tx(conn, order, product_ids, prices, walkin_id, received_at):
+    client_id = order["client_order_id"]
+    row = conn.execute(
+        "SELECT order_id FROM client_orders WHERE client_order_id = ?", (client_id,)
+    ).fetchone()
+    if row:
+        return "duplicate", row["order_id"]
+    order_date = date.fromisoformat(order.get("order_date") or date.today().isoformat())
+    items = []
+    for item in order["items"]:
+        product_id = product_ids.get(str(item.get("sku") or "").strip())
+        if product_id is None:
+            raise ValueError(f"SKU không tồn tại: {item.get('sku')}")
+        # JSON numbers arrive unchecked: 1.7, true, 1e400 or 30-digit integers must
+        # not be truncated, stored as Inf or overflow SQLite's INTEGER.
+        qty = item.get("qty")
+        if isinstance(qty, bool) or not isinstance(qty, int) or not 1 <= qty <= SQLITE_MAX_INTEGER:
+            raise ValueError(f"số lượng không hợp lệ: {item.get('sku')}")
+        price = item.get("price")
+        if price is None:
+            price = prices[product_id]
+        elif isinstance(price, bool) or not isinstance(price, (int, float)):
+            raise ValueError(f"giá không hợp lệ: {item.get('sku')}")
+        else:
+            price = float(price) if abs(price) <= sys.float_info.max else math.inf
+            if not math.isfinite(price) or price < 0:
+                raise ValueError(f"giá không hợp lệ: {item.get('sku')}")
+        items.append({"product_id": product_id, "qty": qty, "price": price})
+    if not math.isfinite(sum(item["qty"] * item["price"] for item in items)):
+        raise ValueError("tổng tiền quá lớn")
+    customer_id = ingest_customer_id(conn, order, walkin_id)
+    status = order.get("status") or "Đã tạo"
+    order_id = create_order_tx(conn, customer_id, order_date.isoformat(), items, status)
+    conn.execute(
+        "INSERT INTO client_orders (client_order_id, order_id, received_at) VALUES (?, ?, ?)",
+        (client_id, order_id, received_at),
+    )
+    return "created", order_id
+
+
+def ingest_batch_tx(conn, orders, sku_map, walkin_id):
+    skus = {
+        str(item.get("sku") or "").strip()
+        for order in orders
+        if not order.get("error")
+        for item in order["items"]
+    }
+    product_ids = sku_map.resolve(conn, skus)
+    prices = product_prices(conn, {pid for pid in product_ids.values() if pid is not None})
+    # A product deleted or re-SKU'd since it was cached: look it up again once.
+    stale = [sku for sku, pid in product_ids.items() if pid is not None and pid not in prices]
+    if stale:
+        sku_map.forget(stale)
+        product_ids.update(sku_map.resolve(conn, stale))
+        prices.update(product_prices(conn, {product_ids[sku] for sku in stale} - {None}))
+        product_ids.update((sku, None) for sku in stale if product_ids[sku] not in prices)
+    received_at = datetime.now().isoformat(timespec="seconds")
+    results = []
+    for order in orders:
+        client_id = str(order.get("client_order_id") or "").strip()
+        if order.get("error") or not client_id:
+            error = order.get("error") or "thiếu client_order_id"
+            results.append((client_id, "rejected", None, error))
+            continue
+        order["client_order_id"] = client_id
+        # Each order gets its own savepoint: a bad order is reported, the rest commit.
+        conn.execute("SAVEPOINT ingest_order")
+        try:
+            outcome, order_id = ingest_order_tx(
+                conn, order, product_ids, prices, walkin_id, received_at
+            )
+        except (
+            ValueError,
+            KeyError,
+            TypeError,
+            OverflowError,
+            OutOfStockError,
+            sqlite3.IntegrityError,
+        ) as exc:
+            conn.execute("ROLLBACK TO ingest_order")
+            conn.execute("RELEASE ingest_order")
+            results.append((client_id, "rejected", None, str(exc)))
+        else:
+            conn.execute("RELEASE ingest_order")
+            results.append((client_id, outcome, order_id, None))
+    return results
+
+
+def ingest_orders(orders):
+    # One writer job per batch, so the whole batch commits in one transaction.
+    with profiled("write", "-- ingest_orders", (len(orders),)) as stat:
+        results = run_write(
+            ingest_batch_tx, orders, get_sku_map(DB_PATH), get_walkin_customer_id(DB_PATH)
+        )
+        stat["rows"] = len(results)
+    if any(outcome == "created" for _, outcome, _, _ in results):
+        invalidate_tables({"orders", "order_items", "stock_movements", "customers"})
+    return results
+
+
+def ingest_jsonl(lines, batch_size=INGEST_BATCH_SIZE, progress=None):
+    summary = {"orders": 0, "created": 0, "duplicate": 0, "rejected": []}
+    start = time.perf_counter()
+    orders = (parse_order_line(line) for line in lines if line.strip())
+    while batch := list(islice(orders, batch_size)):
+        for client_id, outcome, order_id, error in ingest_orders(batch):
+            summary["orders"] += 1
+            if outcome == "rejected":
+                summary["rejected"].append({"client_order_id": client_id, "error": error})
+            else:
+                summary[outcome] += 1
+        if progress:
+            progress(summary)
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    summary["orders_per_sec"] = round(summary["orders"] / max(summary["seconds"], 1e-9), 1)
+    return summary
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.rstrip("/") != "/orders":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.send_json(400, {"error": "invalid Content-Length"})
+            return
+        if length > INGEST_MAX_BYTES:
+            self.send_json(413, {"error": f"body larger than {INGEST_MAX_BYTES} bytes"})
+            return
+        try:
+            body = self.rfile.read(length).decode("utf-8")
+        except UnicodeDecodeError as exc:
+            self.send_json(400, {"error": f"body is not UTF-8: {exc}"})
+            return
+        try:
+            summary = ingest_jsonl(body.splitlines())
+        except Exception as exc:
+            # The batch was rolled back; tell the terminal so it resends rather than
+            # dropping the connection on it.
+            self.log_error("ingest failed: %r", exc)
+            self.send_json(500, {"error": f"{type(exc).__name__}: {exc}"})
+            return
+        self.send_json(200, summary)
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve_ingest(host, port):
+    bootstrap_db(DB_PATH)
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    print(f"Listening on http://{host}:{server.server_port}/orders")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+@resource
+def bootstrap_db(path):
+    # Run once per process: a caller that comes back gets this dict without
+    # touching the schema.
+    steps = {}
+    start = last = time.perf_counter()
+
+    def step(name):
+        nonlocal last
+        now = time.perf_counter()
+        steps[name] = round((now - last) * 1000, 3)
+        last = now
+
+    applied = init_db()
+    step("schema")
+    get_writer(path)
+    step("writer")
+    walkin_id = get_walkin_customer_id(path)
+    step("walkin")
+    get_backup_scheduler(path)
+    step("backup")
+    return {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "applied": applied,
+        "walkin_id": walkin_id,
+        "steps": steps,
+        "total_ms": round((last - start) * 1000, 3),
+    }
+
+
+def check_query_plans():
+    problems = []
+    with get_conn() as conn:
+        ensure_archives(conn)
+        for name, (query, params) in INDEXED_QUERIES.items():
+            for sql in {query.format(db=prefix) for prefix in archive_prefixes()}:
+                for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+                    detail = row["detail"]
+                    indexed = " USING " in detail or " VIRTUAL TABLE INDEX " in detail
+                    if detail.startswith("SCAN ") and not indexed:
+                        problems.append((name, detail))
+    return problems
+
+
+def cli(argv):
+    global DB_PATH
+    parser = argparse.ArgumentParser(description="Công cụ quản trị CSDL bán hàng")
+    parser.add_argument("--db", default=DB_PATH, help="Đường dẫn file SQLite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="Áp dụng các migration còn thiếu")
+    commands.add_parser("check-plans", help="Kiểm tra EXPLAIN QUERY PLAN của các truy vấn")
+    commands.add_parser("rebuild-rollups", help="Tính lại bảng tổng hợp doanh thu theo ngày")
+    commands.add_parser("verify-rollups", help="So sánh bảng tổng hợp với dữ liệu đơn hàng")
+    snapshot = commands.add_parser("snapshot-stock", help="Chụp số dư tồn kho cuối ngày")
+    snapshot.add_argument("--day", help="Ngày (YYYY-MM-DD), mặc định hôm qua")
+    commands.add_parser("verify-stock", help="So sánh tồn kho với sổ kho")
+    archive = commands.add_parser("archive", help="Chuyển đơn hàng cũ sang file lưu trữ theo năm")
+    archive.add_argument("--before", required=True, help="Chuyển các đơn trước ngày này (YYYY-MM-DD)")
+    archive.add_argument(
+        "--keep-status", action="append", default=[], help="Trạng thái đơn chưa đóng, giữ lại"
+    )
+    archive.add_argument("--batch", type=int, default=ARCHIVE_BATCH_SIZE)
+    backup = commands.add_parser("backup", help="Sao lưu trực tuyến CSDL (không chặn ghi)")
+    backup.add_argument("--dir", help="Thư mục sao lưu (mặc định: backups cạnh file CSDL)")
+    backup.add_argument("--gzip", action="store_true", help="Nén bản sao lưu")
+    backup.add_argument("--keep", type=int, default=BACKUP_KEEP, help="Số bản giữ lại, 0 = giữ hết")
+    backup.add_argument("--pages", type=int, default=BACKUP_PAGES, help="Số trang mỗi bước")
+    restore = commands.add_parser("restore", help="Khôi phục bản sao lưu ra file mới")
+    restore.add_argument("backup", help="File sao lưu (.db hoặc .db.gz)")
+    restore.add_argument("target", help="File CSDL mới (không được tồn tại)")
+    export = commands.add_parser("export", help="Xuất dữ liệu ra CSV/XLSX/Parquet")
+    export.add_argument("dataset", choices=list(EXPORT_DATASETS))
+    export.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    export.add_argument("--from", dest="date_from", help="Từ ngày (YYYY-MM-DD)")
+    export.add_argument("--to", dest="date_to", help="Đến ngày (YYYY-MM-DD)")
+    export.add_argument("-o", "--output", help="File đầu ra (mặc định theo tên dữ liệu)")
+    invoices = commands.add_parser("invoices", help="Xuất hóa đơn HTML hàng loạt")
+    invoices.add_argument("--from", dest="date_from", help="Từ ngày (YYYY-MM-DD)")
+    invoices.add_argument("--to", dest="date_to", help="Đến ngày (YYYY-MM-DD)")
+    invoices.add_argument("--ids", help="Danh sách mã đơn, cách nhau bởi dấu phẩy")
+    invoices.add_argument(
+        "-o", "--output", default="invoices", help="Thư mục đầu ra, hoặc file .zip"
+    )
+    invoices.add_argument("--workers", type=int, default=INVOICE_WORKERS)
+    ingest = commands.add_parser("ingest", help="Nhập đơn hàng hàng loạt từ file JSONL (máy POS)")
+    ingest.add_argument("file", help="File JSONL, '-' để đọc từ stdin")
+    ingest.add_argument("--batch", type=int, default=INGEST_BATCH_SIZE)
+    ingest.add_argument("--rejects", help="Ghi các đơn bị từ chối ra file JSONL")
+    serve = commands.add_parser("serve", help="Nhận đơn JSONL qua HTTP tại POST /orders")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    commands.add_parser("customer-stats", help="Cập nhật phân tích khách hàng (RFM) từ đơn mới")
+    args = parser.parse_args(argv)
+    DB_PATH = args.db
+
+    applied = init_db()
+    if args.command == "migrate":
+        with get_conn() as conn:
+            version = get_schema_version(conn)
+        print(f"Schema version {version} (applied: {applied or 'none'})")
+        return 0
+    if args.command == "check-plans":
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f"FULL SCAN  {name}: {detail}")
+        if not problems:
+            print(f"OK: {len(INDEXED_QUERIES)} queries use indexes")
+        return 1 if problems else 0
+    if args.command == "rebuild-rollups":
+        with get_conn() as conn:
+            ensure_archives(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rebuild_sales_rollups(conn, archived=True)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        print("Rebuilt " + ", ".join(SALES_ROLLUPS))
+        return 0
+    if args.command == "verify-rollups":
+        with get_conn() as conn:
+            ensure_archives(conn)
+            mismatches = verify_sales_rollups(conn, archived=True)
+        for table, rows in mismatches.items():
+            for row in rows:
+                print(f"MISMATCH  {table}: {row}")
+        if not mismatches:
+            print("OK: rollups match orders and order_items")
+        return 1 if mismatches else 0
+    if args.command == "snapshot-stock":
+        day = args.day or (date.today() - timedelta(days=1)).isoformat()
+        run_write(take_stock_snapshot, day)
+        print(f"Snapshot stock_snapshots at end of {day}")
+        return 0
+    if args.command == "verify-stock":
+        with get_conn() as conn:
+            mismatches = verify_stock_ledger(conn)
+        for row in mismatches:
+            print(f"MISMATCH  product {row[0]}: stock {row[1]}, ledger {row[2]}")
+        if not mismatches:
+            print("OK: products.stock matches stock_movements")
+        return 1 if mismatches else 0
+    if args.command == "archive":
+        start = time.perf_counter()
+        moved = archive_orders(args.before, args.keep_status, args.batch)
+        elapsed = time.perf_counter() - start
+        for year, count in moved.items():
+            print(f"Archived {count} orders to {archive_path(year)}")
+        total = sum(moved.values())
+        rate = total / elapsed if elapsed else 0
+        print(f"Archived {total} orders in {elapsed:.1f}s ({rate:,.0f}/s)")
+        return 0
+    if args.command == "backup":
+        result = backup_database(args.dir, args.gzip, args.keep, args.pages)
+        print(
+            f"Backed up {result['pages']} pages ({result['bytes'] / 1024**2:,.1f} MB) "
+            f"to {result['path']} in {result['seconds']:.1f}s "
+            f"(copy {result['copy_seconds']:.2f}s, {result['pages_per_sec']:,.0f} pages/s, "
+            f"{result['steps']} steps)"
+        )
+        for path in result["files"][1:]:
+            print(f"  with archive {path}")
+        for path in result["removed"]:
+            print(f"Removed {path}")
+        return 0
+    if args.command == "restore":
+        result = restore_backup(args.backup, args.target)
+        print(
+            f"Restored {args.backup} to {result['path']} (schema version {result['version']}) "
+            f"in {result['seconds']:.1f}s"
+        )
+        for path in result["archives"]:
+            print(f"  with archive {path}")
+        return 0
+    if args.command == "export":
+        output = args.output or export_file_name(
+            args.dataset, args.format, args.date_from, args.date_to
+        )
+        start = time.perf_counter()
+        with open(output, "wb") as out:
+            count = export_dataset(args.dataset, args.format, out, args.date_from, args.date_to)
+        elapsed = time.perf_counter() - start
+        print(f"Exported {count} rows to {output} in {elapsed:.1f}s")
+        return 0
+    if args.command == "invoices":
+        if args.ids:
+            order_ids = [int(value) for value in re.findall(r"\d+", args.ids)]
+        else:
+            order_ids = list_invoice_ids(args.date_from, args.date_to)
+        start = time.perf_counter()
+        count = write_invoices(
+            order_ids, args.output, as_zip=args.output.endswith(".zip"), workers=args.workers
+        )
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0
+        print(f"Rendered {count} invoices to {args.output} in {elapsed:.1f}s ({rate:,.0f}/s)")
+        return 0
+    if args.command == "ingest":
+        source = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+        with source:
+            summary = ingest_jsonl(source, args.batch)
+        if args.rejects:
+            with open(args.rejects, "w", encoding="utf-8") as out:
+                for reject in summary["rejected"]:
+                    out.write(json.dumps(reject, ensure_ascii=False) + "\n")
+        else:
+            for reject in summary["rejected"]:
+                print(f"REJECTED  {reject['client_order_id'] or '?'}: {reject['error']}")
+        print(
+            f"Ingested {summary['orders']} orders: {summary['created']} created, "
+            f"{summary['duplicate']} duplicate, {len(summary['rejected'])} rejected "
+            f"in {summary['seconds']:.1f}s ({summary['orders_per_sec']:,.0f} orders/s)"
+        )
+        return 1 if summary["rejected"] else 0
+    if args.command == "serve":
+        return serve_ingest(args.host, args.port)
+    if args.command == "customer-stats":
+        result = refresh_customer_stats()
+        summary = fetch_customer_summary()
+        print(
+            f"Folded {result['orders']} orders for {result['customers']} customers, "
+            f"rescored {result['rescored']} in {result['seconds']:.2f}s"
+        )
+        if summary and summary["customers"]:
+            print(
+                f"{summary['customers']} customers, "
+                f"repeat rate {summary['repeat_customers'] / summary['customers']:.1%}, "
+                f"average lifetime value {summary['revenue'] / summary['customers']:,.0f}"
+            )
+        return 0
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(cli(sys.argv[1:]))
@@ -0,0 +1,68 @@
+from html import escape
+
+INVOICE_CSS = """
+@page { size: A5; margin: 12mm; }
+body { font-family: "Segoe UI", Arial, sans-serif; color: #1f2933; font-size: 13px; }
+h1 { font-size: 20px; margin: 0 0 4px; }
+.meta { display: flex; justify-content: space-between; margin: 12px 0; }
+.meta div { line-height: 1.6; }
+table { width: 100%; border-collapse: collapse; }
+th, td { padding: 6px 4px; border-bottom: 1px solid #d9e2ec; text-align: left; }
+th.num, td.num { text-align: right; }
+tfoot td { font-weight: 600; border-bottom: none; }
+.print { margin-top: 16px; }
+@media print { .print { display: none; } }
+"""
+
+
+def money(value):
+    return f"{value:,.0f}"
+
+
+def invoice_file_name(order_id):
+    return f"HD{int(order_id):06d}.html"
+
+
+def render_invoice_html(invoice):
+    rows = "".join(
+        "<tr>"
+        f"<td>{index}</td><td>{escape(item['sku'] or '')}</td><td>{escape(item['name'])}</td>"
+        f"<td class=\"num\">{item['qty']}</td><td class=\"num\">{money(item['price'])}</td>"
+        f"<td class=\"num\">{money(item['qty'] * item['price'])}</td>"
+        "</tr>"
+        for index, item in enumerate(invoice["items"], start=1)
+    )
+    contact = "".join(
+        f"<div>{label}: {escape(str(invoice[field]))}</div>"
+        for label, field in (("Điện thoại", "phone"), ("Email", "email"), ("Địa chỉ", "address"))
+        if invoice.get(field)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="vi">
+<head>
+<meta charset="utf-8">
+<title>Hóa đơn {invoice['id']}</title>
+<style>{INVOICE_CSS}</style>
+</head>
+<body>
+<h1>HÓA ĐƠN BÁN HÀNG</h1>
+<div>Số: {invoice['id']}</div>
+<div class="meta">
+<div><div><b>Khách hàng:</b> {escape(invoice['customer'])}</div>{contact}</div>
+<div><div>Ngày: {escape(invoice['order_date'])}</div>
+<div>Trạng thái: {escape(invoice['status'] or '')}</div></div>
+</div>
+<table>
+<thead><tr><th>#</th><th>SKU</th><th>Sản phẩm</th><th class="num">SL</th>
+<th class="num">Đơn giá</th><th class="num">Thành tiền</th></tr></thead>
+<tbody>{rows}</tbody>
+<tfoot><tr><td colspan="5">Tổng cộng</td><td class="num">{money(invoice['total'])}</td></tr></tfoot>
+</table>
+<button class="print" onclick="window.print()">In hóa đơn</button>
+</body>
+</html>
+"""
+
+
+def render_invoice_batch(invoices):
+    return [(invoice_file_name(invoice["id"]), render_invoice_html(invoice)) for invoice in invoices]